@@ -0,0 +1,76 @@
+from datetime import datetime
+
+class TitleTable:
+    """
+    Interns window titles as small integer ids for one fetch, so per-title totals can be kept
+    in a list indexed by id. normalize, if given, maps each raw title to the title it is
+    counted under (e.g. title_normalizer.normalize_title); it runs once per distinct raw title.
+    """
+
+    def __init__(self, normalize=None):
+        self.normalize = normalize
+        self.raw_ids = {}
+        self.ids = {}
+        self.titles = []
+
+    def __len__(self):
+        return len(self.titles)
+
+    def intern(self, raw_title):
+        title_id = self.raw_ids.get(raw_title)
+        if title_id is None:
+            title = self.normalize(raw_title) if self.normalize is not None else raw_title
+            title_id = self.ids.get(title)
+            if title_id is None:
+                title_id = self.ids[title] = len(self.titles)
+                self.titles.append(title)
+            self.raw_ids[raw_title] = title_id
+        return title_id
+
+class Event:
+    """
+    A window event reduced to epoch-second start/end, an interned title id and the
+    seconds that count towards its title (the whole event until AFK filtering clips it).
+    """
+    __slots__ = ('start', 'end', 'title_id', 'duration')
+
+    def __init__(self, start, end, title_id, duration=None):
+        self.start = start
+        self.end = end
+        self.title_id = title_id
+        self.duration = end - start if duration is None else duration
+
+def parse_interval(event):
+    """
+    Parse an ActivityWatch event's timestamp once and return its (start, end) as epoch seconds.
+    """
+    start = datetime.fromisoformat(event['timestamp']).timestamp()
+    return start, start + event['duration']
+
+def events_from_json(raw_events, title_table):
+    """
+    Convert ActivityWatch window events to Events, interning their titles in title_table.
+    """
+    fromisoformat = datetime.fromisoformat
+    intern = title_table.intern
+    events = []
+    for raw_event in raw_events:
+        start = fromisoformat(raw_event['timestamp']).timestamp()
+        end = start + raw_event['duration']
+        events.append(Event(start, end, intern(raw_event.get('data', {}).get('title', 'Unknown')), end - start))
+    return events
+
+def not_afk_intervals(raw_events):
+    """
+    (start, end) epoch-second intervals of the not-afk events in an ActivityWatch AFK bucket.
+    """
+    return [parse_interval(event) for event in raw_events if event['data'].get('status') == 'not-afk']
+
+def sum_by_title(events, title_table):
+    """
+    Total seconds per title: a list indexed by title id, then mapped back to titles.
+    """
+    totals = [0.0] * len(title_table)
+    for event in events:
+        totals[event.title_id] += event.duration
+    return {title_table.titles[title_id]: total for title_id, total in enumerate(totals) if total > 0}
@@ -0,0 +1,249 @@
+import atexit
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+DB_PATH = 'activity_logs.db'
+
+COMMIT_BATCH_SIZE = 10
+COMMIT_INTERVAL = 120  # seconds a stored entry may wait before being committed
+ROLLUP_INTERVAL = 60 * 10
+
+# Retention in days per table; None keeps rows forever.
+RAW_RETENTION_DAYS = 14
+HOURLY_RETENTION_DAYS = 180
+DAILY_RETENTION_DAYS = None
+# Detection decisions kept per source (model tier); the cascade classifier trains on the newest ones.
+DECISION_RETENTION_ROWS = 2000
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS aggregated_logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    start_time DATETIME NOT NULL,
+    end_time DATETIME NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_aggregated_logs_start_time ON aggregated_logs (start_time);
+CREATE INDEX IF NOT EXISTS idx_aggregated_logs_end_time ON aggregated_logs (end_time);
+
+CREATE TABLE IF NOT EXISTS hourly_rollups (
+    bucket_start DATETIME NOT NULL,
+    title TEXT NOT NULL,
+    duration REAL NOT NULL,
+    PRIMARY KEY (bucket_start, title)
+);
+
+CREATE TABLE IF NOT EXISTS daily_rollups (
+    day DATE NOT NULL,
+    title TEXT NOT NULL,
+    duration REAL NOT NULL,
+    PRIMARY KEY (day, title)
+);
+
+CREATE TABLE IF NOT EXISTS rollup_state (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    last_rolled_id INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO rollup_state (id, last_rolled_id) VALUES (1, 0);
+
+CREATE TABLE IF NOT EXISTS detection_decisions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    decided_at DATETIME NOT NULL,
+    recent TEXT NOT NULL,
+    context TEXT NOT NULL,
+    decision TEXT NOT NULL,
+    source TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_detection_decisions_source ON detection_decisions (source, id);
+'''
+
+class ActivityStore:
+    """
+    Durable SQLite store for aggregated activity windows.
+    Entries are kept as JSON, committed in batches, and rolled up into hourly and daily
+    per-title totals in the background so old raw rows can be pruned.
+    """
+
+    def __init__(self, db_path=DB_PATH):
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.pending = []
+        self.last_commit = time.monotonic()
+        self.rollup_thread = None
+        self.closed = False
+
+        with self.lock:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self.conn.executescript(SCHEMA)
+            # Rows written by older versions hold Python reprs rather than JSON and cannot be queried.
+            removed = self.conn.execute('DELETE FROM aggregated_logs WHERE json_valid(data) = 0').rowcount
+            self.conn.commit()
+        if removed:
+            logging.info(f"Dropped {removed} legacy non-JSON rows from aggregated_logs.")
+
+    def store(self, start_time, end_time, aggregated_data):
+        """
+        Queue one aggregated window for writing. Commits once COMMIT_BATCH_SIZE entries
+        are pending or COMMIT_INTERVAL seconds have passed since the last commit.
+        """
+        with self.lock:
+            self.pending.append((start_time.isoformat(), end_time.isoformat(), json.dumps(aggregated_data)))
+            if len(self.pending) >= COMMIT_BATCH_SIZE or time.monotonic() - self.last_commit >= COMMIT_INTERVAL:
+                self.flush()
+
+    def flush(self):
+        """
+        Write all pending entries in a single transaction.
+        """
+        with self.lock:
+            if self.pending:
+                self.conn.executemany(
+                    'INSERT INTO aggregated_logs (start_time, end_time, data) VALUES (?, ?, ?)',
+                    self.pending
+                )
+                self.conn.commit()
+                logging.info(f"Committed {len(self.pending)} aggregated entries.")
+                self.pending = []
+            self.last_commit = time.monotonic()
+
+    def entries_between(self, start_time, end_time):
+        """
+        Returns stored entries whose end_time falls within [start_time, end_time], oldest first,
+        in the same shape as log_watcher's aggregated_data_entry.
+        """
+        with self.lock:
+            self.flush()
+            rows = self.conn.execute(
+                'SELECT start_time, end_time, data FROM aggregated_logs '
+                'WHERE end_time >= ? AND end_time <= ? ORDER BY end_time',
+                (start_time.isoformat(), end_time.isoformat())
+            ).fetchall()
+        return [{'start_time': start, 'end_time': end, 'data': json.loads(data)} for start, end, data in rows]
+
+    def record_decision(self, recent_logs, context_logs, decision, source):
+        """
+        Log one detection decision and the inputs it was made on. source names the model tier.
+        """
+        with self.lock:
+            self.conn.execute(
+                'INSERT INTO detection_decisions (decided_at, recent, context, decision, source) VALUES (?, ?, ?, ?, ?)',
+                (datetime.now(timezone.utc).isoformat(), json.dumps(recent_logs), json.dumps(context_logs), decision, source)
+            )
+            self.conn.commit()
+
+    def labeled_decisions(self, source, limit):
+        """
+        Returns up to limit of the most recent (recent_logs, context_logs, decision) samples from source.
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT recent, context, decision FROM detection_decisions WHERE source = ? ORDER BY id DESC LIMIT ?',
+                (source, limit)
+            ).fetchall()
+        return [(json.loads(recent), json.loads(context), decision) for recent, context, decision in rows]
+
+    def rollup(self):
+        """
+        Fold raw rows added since the last rollup into hourly and daily per-title totals,
+        then apply the retention limits. Runs as one transaction.
+        """
+        with self.lock:
+            self.flush()
+            last_rolled_id = self.conn.execute('SELECT last_rolled_id FROM rollup_state WHERE id = 1').fetchone()[0]
+            rows = self.conn.execute(
+                'SELECT id, start_time, data FROM aggregated_logs WHERE id > ? ORDER BY id',
+                (last_rolled_id,)
+            ).fetchall()
+
+            hourly = defaultdict(float)
+            daily = defaultdict(float)
+            for row_id, start_time, data in rows:
+                start = datetime.fromisoformat(start_time)
+                hour = start.replace(minute=0, second=0, microsecond=0).isoformat()
+                day = start.date().isoformat()
+                for title, duration in json.loads(data).items():
+                    hourly[(hour, title)] += duration
+                    daily[(day, title)] += duration
+                last_rolled_id = row_id
+
+            self.conn.executemany(
+                'INSERT INTO hourly_rollups (bucket_start, title, duration) VALUES (?, ?, ?) '
+                'ON CONFLICT (bucket_start, title) DO UPDATE SET duration = duration + excluded.duration',
+                [(hour, title, duration) for (hour, title), duration in hourly.items()]
+            )
+            self.conn.executemany(
+                'INSERT INTO daily_rollups (day, title, duration) VALUES (?, ?, ?) '
+                'ON CONFLICT (day, title) DO UPDATE SET duration = duration + excluded.duration',
+                [(day, title, duration) for (day, title), duration in daily.items()]
+            )
+            self.conn.execute('UPDATE rollup_state SET last_rolled_id = ? WHERE id = 1', (last_rolled_id,))
+            pruned = self._apply_retention(last_rolled_id)
+            self.conn.commit()
+
+        logging.info(f"Rolled up {len(rows)} aggregated entries; pruned {pruned} expired rows.")
+
+    def _apply_retention(self, last_rolled_id):
+        """
+        Delete rows past their retention period. Raw rows are only deleted once rolled up.
+        Detection decisions are capped at the newest DECISION_RETENTION_ROWS per source.
+        """
+        now = datetime.now(timezone.utc)
+        pruned = 0
+        if RAW_RETENTION_DAYS is not None:
+            cutoff = (now - timedelta(days=RAW_RETENTION_DAYS)).isoformat()
+            pruned += self.conn.execute(
+                'DELETE FROM aggregated_logs WHERE end_time < ? AND id <= ?', (cutoff, last_rolled_id)
+            ).rowcount
+        if HOURLY_RETENTION_DAYS is not None:
+            cutoff = (now - timedelta(days=HOURLY_RETENTION_DAYS)).isoformat()
+            pruned += self.conn.execute('DELETE FROM hourly_rollups WHERE bucket_start < ?', (cutoff,)).rowcount
+        if DAILY_RETENTION_DAYS is not None:
+            cutoff = (now - timedelta(days=DAILY_RETENTION_DAYS)).date().isoformat()
+            pruned += self.conn.execute('DELETE FROM daily_rollups WHERE day < ?', (cutoff,)).rowcount
+        sources = [row[0] for row in self.conn.execute('SELECT DISTINCT source FROM detection_decisions')]
+        for source in sources:
+            oldest_dropped = self.conn.execute(
+                'SELECT id FROM detection_decisions WHERE source = ? ORDER BY id DESC LIMIT 1 OFFSET ?',
+                (source, DECISION_RETENTION_ROWS)
+            ).fetchone()
+            if oldest_dropped is not None:
+                pruned += self.conn.execute(
+                    'DELETE FROM detection_decisions WHERE source = ? AND id <= ?', (source, oldest_dropped[0])
+                ).rowcount
+        return pruned
+
+    def _rollup_loop(self):
+        while True:
+            time.sleep(ROLLUP_INTERVAL)
+            try:
+                self.rollup()
+            except sqlite3.Error as e:
+                logging.error(f"Activity rollup failed: {e}", exc_info=True)
+
+    def start_rollup_thread(self):
+        """
+        Start the background rollup/retention thread once.
+        """
+        if self.rollup_thread is None:
+            self.rollup_thread = threading.Thread(target=self._rollup_loop, name="ActivityRollupThread", daemon=True)
+            self.rollup_thread.start()
+
+    def close(self):
+        """
+        Commit anything pending and close the connection. Safe to call more than once.
+        """
+        with self.lock:
+            if self.closed:
+                return
+            self.flush()
+            self.conn.close()
+            self.closed = True
+
+# Shared by the log watcher (aggregates) and detection (decision log).
+activity_store = ActivityStore()
+atexit.register(activity_store.close)
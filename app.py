@@ -1,18 +1,32 @@
-from flask import Flask, render_template, request, redirect, url_for, session
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify
 from flask_socketio import SocketIO, emit
 import logging
 import os
+import uuid
 
 from conversational_agent_backend import (
     retrieve_all_knowledge_with_ids,
+    retrieve_relevant_knowledge,
     knowledge_count,
     generate_personalized_response,
+    stream_personalized_response,
+    clean_assistant_reply,
     summarize_conversation,
+    summarize_history,
+    DEFAULT_OPENING_MESSAGE,
     insert_knowledge_entry,
-    delete_knowledge_by_id
+    replace_knowledge_entries
 )
 
 from shared_state import set_conversation_active, is_conversation_active
+from conversation_memory import ConversationSessions
+from summary_jobs import SummaryJobQueue
+from chat_prewarm import chat_prewarm
+from detection_llm import get_detection_stats
+from detection_scheduler import detection_scheduler
+from inference_scheduler import inference_scheduler
+from log_watcher import get_watcher_stats
+from prompt_builder import get_prompt_stats
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your_secret_key')
@@ -20,6 +34,13 @@ app.config['SESSION_TYPE'] = 'filesystem'
 
 socketio = SocketIO(app, ping_timeout=120, ping_interval=25)
 
+# Maximum number of stored knowledge entries. Only the most relevant few go into each prompt,
+# so this no longer has to stay small to keep the prompt short.
+KNOWLEDGE_LIMIT = 2000
+
+# Push assistant replies to the browser token by token as 'assistant_token' events.
+STREAM_RESPONSES = True
+
 logging.basicConfig(
     level=logging.DEBUG,
     format='%(asctime)s %(levelname)s:%(message)s',
@@ -29,24 +50,36 @@ logging.basicConfig(
     ]
 )
 
-# Global conversation_history that resets on new conversation or end_chat
-conversation_history = []
+# Per-conversation history: recent turns plus a rolling summary, reset on end_chat
+conversation_sessions = ConversationSessions(summarize_history)
+
+def conversation_key():
+    """
+    Key of the caller's conversation: the Flask session's conversation id,
+    or the Socket.IO sid for clients that never loaded the chat page.
+    """
+    if 'conversation_id' in session:
+        return session['conversation_id']
+    sid = getattr(request, 'sid', None)
+    if sid is not None:
+        return sid
+    session['conversation_id'] = uuid.uuid4().hex
+    return session['conversation_id']
 
 @app.route('/')
 def index():
     """
-    Renders the chat interface. If the global conversation is empty,
+    Renders the chat interface. If this session's conversation is empty,
     start a new conversation and mark it as active. Also pass in
-    knowledge_count for display logic (9-entry limit).
+    knowledge_count for display logic (KNOWLEDGE_LIMIT entries).
     """
-    global conversation_history
     try:
-        if not conversation_history:
-            assistant_prompt = (
-                "Hi, I've noticed you might be having trouble focusing. "
-                "Could you tell me what's on your mind?"
-            )
-            conversation_history.append(["Assistant", assistant_prompt])
+        session.setdefault('conversation_id', uuid.uuid4().hex)
+        memory = conversation_sessions.get(conversation_key())
+        if not len(memory):
+            # Use the warm-up started when detection fired, if it has finished.
+            opening = chat_prewarm.take()
+            memory.add_turn("Assistant", opening or DEFAULT_OPENING_MESSAGE)
             set_conversation_active(True)
             logging.info("New conversation started and set to active.")
 
@@ -54,8 +87,9 @@ def index():
 
         return render_template(
             'chat.html',
-            conversation_history=conversation_history,
-            knowledge_count=current_knowledge_count
+            conversation_history=memory.context()[1],
+            knowledge_count=current_knowledge_count,
+            knowledge_limit=KNOWLEDGE_LIMIT
         )
     except Exception as e:
         logging.error(f"Error rendering chat interface: {e}", exc_info=True)
@@ -67,33 +101,47 @@ def handle_user_message(json):
     """
     Handles inbound user messages from the chat interface,
     generates a response, and emits it back to the client.
+    In streaming mode each generated piece is emitted as 'assistant_token',
+    followed by 'assistant_message_done' carrying the full reply, or the error text if the
+    stream fails partway so the client can close the partial reply.
     """
-    global conversation_history
+    streaming = False
     try:
+        memory = conversation_sessions.get(conversation_key())
         user_input = json.get('message', '').strip()
         if not user_input:
             emit('assistant_message', {'message': "I didn't catch that. Can you rephrase?"})
             logging.debug("Received empty user input; prompted for rephrasing.")
             return
 
-        logging.debug(f"Current conversation history before update: {conversation_history}")
+        history = memory.context()
+        logging.debug(f"Current conversation history before update: {history}")
 
-        conversation_history.append(["User", user_input])
-        logging.debug(f"Updated conversation history with user message: {conversation_history}")
+        memory.add_turn("User", user_input)
 
-        knowledge_entries_with_ids = retrieve_all_knowledge_with_ids()
-        knowledge_only = [item[1] for item in knowledge_entries_with_ids]
+        knowledge_only = retrieve_relevant_knowledge(user_input)
 
-        agent_response = generate_personalized_response(user_input, knowledge_only)
+        if STREAM_RESPONSES:
+            streaming = True
+            pieces = []
+            for token in stream_personalized_response(user_input, knowledge_only, history):
+                pieces.append(token)
+                emit('assistant_token', {'token': token})
+                socketio.sleep(0)
+            agent_response = clean_assistant_reply(''.join(pieces))
+        else:
+            agent_response = generate_personalized_response(user_input, knowledge_only, history)
         logging.info(f"Assistant response generated: {agent_response}")
 
-        conversation_history.append(["Assistant", agent_response])
-        logging.debug(f"Updated conversation history with assistant response: {conversation_history}")
+        memory.add_turn("Assistant", agent_response)
 
-        emit('assistant_message', {'message': agent_response})
+        if STREAM_RESPONSES:
+            emit('assistant_message_done', {'message': agent_response})
+        else:
+            emit('assistant_message', {'message': agent_response})
     except Exception as e:
         logging.error(f"Error handling user message: {e}", exc_info=True)
-        emit('assistant_message', {'message': "An error occurred while processing your request."})
+        emit('assistant_message_done' if streaming else 'assistant_message', {'message': "An error occurred while processing your request."})
 
 
 @app.route('/end_chat_no_save', methods=['POST'])
@@ -101,64 +149,90 @@ def end_chat_no_save():
     """
     Ends the chat WITHOUT saving any summary to the knowledge base.
     """
-    global conversation_history
     try:
         logging.info("Ending chat with NO saving.")
-        conversation_history.clear()
+        conversation_sessions.end(conversation_key())
         set_conversation_active(False)
         return "Chat ended successfully, without saving."
     except Exception as e:
         logging.error(f"Error ending chat without saving: {e}", exc_info=True)
         return "An error occurred while ending the chat (no save).", 500
 
+def process_summary_job(transcript):
+    """
+    Summary job body: summarize the conversation and save it if the knowledge base has room.
+    Returns (status, summary); 'needs_review' leaves the summary for the memory management page.
+    """
+    summary = summarize_conversation(transcript).strip()
+    logging.info(f"Generated summary for saving: {summary}")
+
+    if not summary:
+        logging.info("Empty summary. Nothing to store. Ending chat.")
+        return 'empty', ''
+
+    if knowledge_count() < KNOWLEDGE_LIMIT:
+        insert_knowledge_entry(summary)
+        logging.info(f"Inserted new summary into knowledge base (fewer than {KNOWLEDGE_LIMIT} entries).")
+        return 'saved', summary
+
+    logging.info(f"Knowledge base at {KNOWLEDGE_LIMIT}. Summary awaits memory management.")
+    return 'needs_review', summary
+
+def publish_summary_job(job):
+    """
+    Push summary job status changes to chat pages as 'summary_job_status'.
+    The chat is over once its job stops running, whatever the outcome; a summary awaiting
+    review on the memory management page must not keep detection suppressed.
+    """
+    if job['status'] not in ('pending', 'running'):
+        set_conversation_active(False)
+    socketio.emit('summary_job_status', job)
+
+summary_jobs = SummaryJobQueue(process_summary_job, publish_summary_job)
+
 @app.route('/end_chat_save', methods=['POST'])
 def end_chat_save():
     """
-    Summarizes the conversation, then attempts to save it to the knowledge base.
-    If the knowledge base is not at the limit (9 entries), we insert and end.
-    If it IS at the limit, we redirect the user to a memory management page
-    where they can choose to delete some entries or abandon saving.
+    Queues a background job that summarizes the conversation and attempts to save it to
+    the knowledge base, and returns its id right away. Progress is reported by
+    GET /summary_jobs/<job_id> and the 'summary_job_status' Socket.IO event.
+    If the knowledge base is at the limit (KNOWLEDGE_LIMIT entries), the job ends as
+    'needs_review' and the page sends the user to memory management for that job.
     """
-    global conversation_history
     try:
         logging.info("Ending chat WITH saving.")
-        summary = summarize_conversation(conversation_history).strip()
-        logging.info(f"Generated summary for saving: {summary}")
-
-        if not summary:
-            logging.info("Empty summary. Nothing to store. Ending chat.")
-            conversation_history.clear()
-            set_conversation_active(False)
-            return "Chat ended successfully, no summary."
-
-        if knowledge_count() < 9:
-            insert_knowledge_entry(summary)
-            logging.info("Inserted new summary into knowledge base (fewer than 9 entries).")
-
-            conversation_history.clear()
-            set_conversation_active(False)
-            return "Chat ended successfully, after saving summary."
-        else:
-            session['pending_summary'] = summary
-            logging.info("Knowledge base at 9. Redirecting to memory management.")
-            return redirect(url_for('manage_memory'))
+        key = conversation_key()
+        job_id = summary_jobs.submit(conversation_sessions.get(key).transcript())
+        conversation_sessions.end(key)
+        logging.info(f"Queued summary job {job_id}.")
+        return jsonify({'job_id': job_id, 'status': 'pending'}), 202
 
     except Exception as e:
         logging.error(f"Error ending chat with saving: {e}", exc_info=True)
         return "An error occurred while ending the chat (save).", 500
 
+@app.route('/summary_jobs/<job_id>')
+def summary_job_status(job_id):
+    """
+    Returns the status of a summary job queued by end_chat_save.
+    """
+    job = summary_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job)
+
 @app.route('/manage_memory')
 def manage_memory():
     """
-    Shows the user the existing 9 knowledge entries and the new summary.
+    Shows the user the existing knowledge entries and the new summary of the given job.
     Allows them to select some knowledge to delete, or skip saving the new summary.
     """
     try:
-        summary = session.get('pending_summary', '')
-        if not summary:
+        job = summary_jobs.get(request.args.get('job_id', ''))
+        if job is None or job['status'] != 'needs_review':
             return redirect(url_for('index'))
         knowledge_list = retrieve_all_knowledge_with_ids()
-        return render_template('manage_memory.html', knowledge_list=knowledge_list, summary=summary)
+        return render_template('manage_memory.html', knowledge_list=knowledge_list, summary=job['summary'], job_id=job['id'])
     except Exception as e:
         logging.error(f"Error loading manage_memory page: {e}", exc_info=True)
         return "An error occurred while managing memory.", 500
@@ -168,37 +242,28 @@ def manage_memory():
 def manage_memory_action():
     """
     Handles user actions from the memory management page.
-    - If they clicked "Never Mind", we discard the pending summary and keep the existing 9.
+    - If they clicked "Never Mind", we discard the pending summary and keep the existing entries.
     - If they clicked "Delete Selected & Save New Summary", we delete the chosen items, then insert the new summary.
     """
-    global conversation_history
     try:
         action = request.form.get('action')
-        summary = session.get('pending_summary', '')
+        job = summary_jobs.get(request.form.get('job_id', ''))
+        if job is None or job['status'] != 'needs_review':
+            return redirect(url_for('index'))
 
         if action == 'never_mind':
             logging.info("User chose to NOT replace any memory. Discarding new summary.")
+            summary_jobs.update(job['id'], 'discarded')
 
-            session.pop('pending_summary', None)
-
-            conversation_history.clear()
             set_conversation_active(False)
             return "Chat ended successfully, after no update was made."
         
         elif action == 'save_delete':
-            if not summary:
-                return redirect(url_for('index'))
-
             delete_ids = request.form.getlist('delete_ids')
             logging.info(f"Deleting the following knowledge IDs: {delete_ids}")
-            for knowledge_id in delete_ids:
-                delete_knowledge_by_id(knowledge_id)
-
-            insert_knowledge_entry(summary)
+            replace_knowledge_entries(delete_ids, [job['summary']])
+            summary_jobs.update(job['id'], 'saved')
 
-            session.pop('pending_summary', None)
-
-            conversation_history.clear()
             set_conversation_active(False)
             return "Chat ended successfully, after new summary."
 
@@ -212,6 +277,21 @@ def manage_memory_action():
         return "An error occurred while processing your memory management action.", 500
 
 
+@app.route('/stats')
+def stats():
+    """
+    Runtime counters from every subsystem as JSON: inference scheduling, prompt sizes,
+    detection tiers, ActivityWatch fetches and the chat warm-up.
+    """
+    return jsonify({
+        'inference': inference_scheduler.stats(),
+        'prompts': get_prompt_stats(),
+        'detection': get_detection_stats(),
+        'detection_scheduler': dict(detection_scheduler.stats),
+        'log_watcher': get_watcher_stats(),
+        'chat_prewarm': chat_prewarm.stats()
+    })
+
 @socketio.on('disconnect')
 def handle_disconnect():
     """
@@ -0,0 +1,144 @@
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+
+def sample_durations(rng, n_titles):
+    """
+    Random per-title durations shaped like one aggregated_logs entry.
+    """
+    titles = [f"Project notes {i} - Google Docs" for i in range(n_titles)]
+    titles += ["Reddit - Dive into anything", "YouTube"]
+    return {title: round(rng.uniform(1, 120), 1) for title in rng.sample(titles, n_titles)}
+
+def bench_detection_prefill(runs=5, seed=0):
+    """
+    Compare detection prefill time with and without reusing the cached static prompt prefix.
+    Requires the detection model configured in detection_llm.MODEL_PATH.
+    """
+    import detection_llm
+    import llm_runtime
+
+    rng = random.Random(seed)
+    runtime = llm_runtime.get_runtime(detection_llm.MODEL_PATH, detection_llm.DETECTION_CONTEXT_SIZE)
+    runtime.warm_prefix(detection_llm.DETECTION_PROMPT_PREFIX, detection_llm.DETECTION_PREFIX_CACHE_NAME)
+
+    results = {}
+    for cache_prompt in (False, True):
+        prompt_ms, prompt_tokens = [], []
+        for _ in range(runs):
+            input_text = detection_llm.build_detection_prompt(sample_durations(rng, 8), sample_durations(rng, 20))
+            response = runtime.request(input_text, n_predict=1, cache_prompt=cache_prompt)
+            timings = response.get("timings", {})
+            prompt_ms.append(timings.get("prompt_ms", 0.0))
+            prompt_tokens.append(timings.get("prompt_n", 0))
+        results[cache_prompt] = (statistics.mean(prompt_ms), statistics.mean(prompt_tokens))
+
+    for cache_prompt, (mean_ms, mean_tokens) in results.items():
+        label = "with prefix cache" if cache_prompt else "without cache"
+        print(f"{label:>18}: prefill {mean_ms:8.1f} ms avg over {runs} runs, {mean_tokens:6.0f} tokens evaluated")
+    if results[True][0]:
+        print(f"speedup: {results[False][0] / results[True][0]:.1f}x")
+
+def synthetic_buckets(rng, n_events):
+    """
+    Back-to-back window events plus alternating afk/not-afk periods covering the same span,
+    in the shape returned by the ActivityWatch events API.
+    """
+    origin = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    window_events, afk_events = [], []
+    offset = 0.0
+    for i in range(n_events):
+        duration = rng.uniform(1, 30)
+        window_events.append({
+            'timestamp': (origin + timedelta(seconds=offset)).isoformat(),
+            'duration': duration,
+            'data': {'title': f"Title {i % 500}"}
+        })
+        offset += duration
+    afk_offset, status = 0.0, 'not-afk'
+    while afk_offset < offset:
+        duration = rng.uniform(60, 900)
+        afk_events.append({
+            'timestamp': (origin + timedelta(seconds=afk_offset)).isoformat(),
+            'duration': duration,
+            'data': {'status': status}
+        })
+        afk_offset += duration
+        status = 'afk' if status == 'not-afk' else 'not-afk'
+    return window_events, afk_events
+
+def bench_afk_filter(runs=3, seed=0):
+    """
+    Time log_watcher.filter_non_afk_events as the number of window events grows.
+    """
+    from activity_events import TitleTable, events_from_json, not_afk_intervals
+    from log_watcher import filter_non_afk_events
+
+    rng = random.Random(seed)
+    for n_events in (1_000, 10_000, 100_000, 300_000):
+        window_events, afk_events = synthetic_buckets(rng, n_events)
+        events = events_from_json(window_events, TitleTable())
+        not_afk_periods = not_afk_intervals(afk_events)
+        elapsed = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            filter_non_afk_events(events, not_afk_periods)
+            elapsed.append(time.perf_counter() - started)
+        best = min(elapsed)
+        print(f"{n_events:>8} events, {len(afk_events):>6} afk periods: {best * 1000:9.1f} ms "
+              f"({best / n_events * 1e6:.2f} us/event)")
+
+def bench_event_pipeline(runs=3, seed=0):
+    """
+    Time each stage of a raw fetch (parse to Events, AFK filter, per-title sum) and compare
+    the memory held by the Events with the ActivityWatch JSON they replace.
+    """
+    import tracemalloc
+    from activity_events import TitleTable, events_from_json, not_afk_intervals, sum_by_title
+    from log_watcher import filter_non_afk_events
+
+    rng = random.Random(seed)
+    for n_events in (10_000, 100_000):
+        window_events, afk_events = synthetic_buckets(rng, n_events)
+        stages = {'parse': [], 'filter': [], 'aggregate': []}
+        for _ in range(runs):
+            title_table = TitleTable()
+            started = time.perf_counter()
+            events = events_from_json(window_events, title_table)
+            not_afk_periods = not_afk_intervals(afk_events)
+            parsed = time.perf_counter()
+            filtered = filter_non_afk_events(events, not_afk_periods)
+            filtered_at = time.perf_counter()
+            sum_by_title(filtered, title_table)
+            stages['parse'].append(parsed - started)
+            stages['filter'].append(filtered_at - parsed)
+            stages['aggregate'].append(time.perf_counter() - filtered_at)
+
+        tracemalloc.start()
+        json_events, _ = synthetic_buckets(random.Random(seed), n_events)
+        json_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        tracemalloc.start()
+        compact_events = events_from_json(json_events, TitleTable())
+        event_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del compact_events, json_events
+
+        timings = ", ".join(f"{stage} {min(elapsed) * 1000:7.1f} ms" for stage, elapsed in stages.items())
+        print(f"{n_events:>8} events: {timings}; memory {json_bytes / n_events:.0f} B/event as JSON, "
+              f"{event_bytes / n_events:.0f} B/event as Events")
+
+BENCHMARKS = {
+    'prefill': bench_detection_prefill,
+    'afk_filter': bench_afk_filter,
+    'events': bench_event_pipeline,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the activity watcher pipeline.")
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](runs=args.runs)
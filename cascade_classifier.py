@@ -0,0 +1,148 @@
+import bisect
+import math
+import threading
+from collections import defaultdict
+
+# Seconds bins used to turn the longest distracting-site duration into a discrete feature.
+SITE_DURATION_BINS = (60, 90, 120, 180, 240, 300)
+# Raw posterior bin edges for calibration; each bin maps to the accuracy measured on held-out folds.
+CALIBRATION_BINS = (0.6, 0.7, 0.8, 0.9, 0.95, 0.99)
+CALIBRATION_FOLDS = 5
+SITE_FEATURE_PREFIXES = ('recent_site:', 'context_site:')
+
+def duration_weight(seconds):
+    """
+    Pseudo-count for a title feature; grows slowly so one long activity does not dominate.
+    """
+    return math.log1p(max(seconds, 0.0) / 10.0)
+
+class NaiveBayesModel:
+    """
+    Multinomial Naive Bayes over weighted features; fitted once and then read-only.
+    """
+
+    def __init__(self, feature_samples, smoothing):
+        self.smoothing = smoothing
+        self.class_counts = defaultdict(int)
+        self.feature_totals = defaultdict(float)
+        self.feature_weights = defaultdict(lambda: defaultdict(float))
+        self.vocabulary = set()
+        for features, decision in feature_samples:
+            self.class_counts[decision] += 1
+            for feature, weight in features.items():
+                self.feature_weights[decision][feature] += weight
+                self.feature_totals[decision] += weight
+                self.vocabulary.add(feature)
+
+    def posterior(self, features):
+        """
+        Returns (most likely decision, its raw posterior probability).
+        """
+        total = sum(self.class_counts.values())
+        vocabulary_size = len(self.vocabulary) or 1
+        log_scores = {}
+        for label, count in self.class_counts.items():
+            denominator = self.feature_totals[label] + self.smoothing * vocabulary_size
+            weights = self.feature_weights[label]
+            score = math.log(count / total)
+            for feature, weight in features.items():
+                score += weight * math.log((weights.get(feature, 0.0) + self.smoothing) / denominator)
+            log_scores[label] = score
+
+        best = max(log_scores, key=log_scores.get)
+        normalizer = sum(math.exp(score - log_scores[best]) for score in log_scores.values())
+        return best, 1.0 / normalizer
+
+class CascadeClassifier:
+    """
+    Naive Bayes over activity features, trained on decisions the detection LLM has already
+    made. Used as the cheap first model tier: confident predictions are taken as-is, anything
+    else is escalated to the LLM.
+    The raw Naive Bayes posterior is far too sure of itself, so predict() reports a calibrated
+    confidence: the accuracy that predictions in the same posterior bin had on held-out folds
+    of the training data. Inputs with a distracting-site feature never seen in training get
+    no confidence at all.
+    site_durations maps a durations dict to {distracting site: seconds}.
+    """
+
+    def __init__(self, site_durations, smoothing=1.0):
+        self.site_durations = site_durations
+        self.smoothing = smoothing
+        self.lock = threading.Lock()
+        self.model = None
+        self.calibration = [(0, 0)] * (len(CALIBRATION_BINS) + 1)  # (correct, total) per bin
+
+    def features(self, recent_logs, context_logs):
+        """
+        Weighted features: recent and context titles, plus a binned duration for each distracting site.
+        """
+        weights = defaultdict(float)
+        for title, seconds in recent_logs.items():
+            weights[f"recent:{title.strip().lower()}"] += duration_weight(seconds)
+        for title, seconds in context_logs.items():
+            weights[f"context:{title.strip().lower()}"] += duration_weight(seconds)
+        for site, seconds in self.site_durations(recent_logs).items():
+            weights[f"recent_site:{site}:{bisect.bisect_right(SITE_DURATION_BINS, seconds)}"] += 1.0
+        for site, seconds in self.site_durations(context_logs).items():
+            weights[f"context_site:{site}:{bisect.bisect_right(SITE_DURATION_BINS, seconds)}"] += 1.0
+        return weights
+
+    def train(self, samples):
+        """
+        Rebuild the model from (recent_logs, context_logs, decision) samples and recalibrate it
+        with CALIBRATION_FOLDS-fold cross-validation.
+        """
+        feature_samples = [(self.features(recent, context), decision) for recent, context, decision in samples]
+        calibration = [[0, 0] for _ in range(len(CALIBRATION_BINS) + 1)]
+        if len(feature_samples) >= CALIBRATION_FOLDS:
+            for fold in range(CALIBRATION_FOLDS):
+                held_out = feature_samples[fold::CALIBRATION_FOLDS]
+                fold_model = NaiveBayesModel(
+                    [sample for index, sample in enumerate(feature_samples) if index % CALIBRATION_FOLDS != fold],
+                    self.smoothing
+                )
+                if len(fold_model.class_counts) < 2:
+                    continue
+                for features, decision in held_out:
+                    predicted, probability = fold_model.posterior(features)
+                    calibration_bin = calibration[bisect.bisect_right(CALIBRATION_BINS, probability)]
+                    calibration_bin[0] += predicted == decision
+                    calibration_bin[1] += 1
+
+        model = NaiveBayesModel(feature_samples, self.smoothing)
+        with self.lock:
+            self.model = model
+            self.calibration = [tuple(calibration_bin) for calibration_bin in calibration]
+
+    def class_counts(self):
+        with self.lock:
+            return dict(self.model.class_counts) if self.model is not None else {}
+
+    def is_trained(self, min_samples_per_class):
+        counts = self.class_counts()
+        return len(counts) == 2 and min(counts.values()) >= min_samples_per_class
+
+    def unseen_site_features(self, features):
+        """
+        Distracting-site features of an input that never occurred in training.
+        """
+        with self.lock:
+            vocabulary = self.model.vocabulary if self.model is not None else set()
+        return [feature for feature in features if feature.startswith(SITE_FEATURE_PREFIXES) and feature not in vocabulary]
+
+    def predict(self, recent_logs, context_logs):
+        """
+        Returns (decision, calibrated confidence) for the most likely decision.
+        Returns (None, 0.0) if untrained or if the input has a distracting-site feature the model never saw.
+        """
+        features = self.features(recent_logs, context_logs)
+        with self.lock:
+            model = self.model
+            calibration = self.calibration
+        if model is None or len(model.class_counts) < 2 or self.unseen_site_features(features):
+            return None, 0.0
+
+        decision, probability = model.posterior(features)
+        correct, total = calibration[bisect.bisect_right(CALIBRATION_BINS, probability)]
+        # Laplace-smoothed held-out accuracy, so a thinly populated bin cannot look certain.
+        return decision, (correct + 1) / (total + 2)
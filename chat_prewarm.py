@@ -0,0 +1,89 @@
+import logging
+import threading
+
+from conversational_agent_backend import generate_opening_message, prefill_system_prompt
+from inference_scheduler import DETECTION, InferenceNotRun
+
+# Also pre-generate the opening assistant message, not only prefill the system prompt.
+PREGENERATE_OPENING = True
+
+class ChatPrewarm:
+    """
+    Speculative chat warm-up, started when detection fires and the user is being asked to chat.
+    Loads the chat model, prefills the system prompt and optionally generates the opening
+    message, so the chat page and the first reply do not wait for a cold model. Knowledge is
+    still retrieved per message, after the prefilled instructions. Runs at detection priority
+    so it never delays real chat work; discard() throws the result away if the user denies.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.generation = 0  # bumped by every start, discard and take; stale warm-ups are dropped
+        self.ready = False
+        self.opening = None
+        self.counts = {'started': 0, 'ready': 0, 'used': 0, 'discarded': 0, 'failed': 0}
+
+    def start(self):
+        with self.lock:
+            self.generation += 1
+            generation = self.generation
+            self.ready = False
+            self.opening = None
+            self.counts['started'] += 1
+        threading.Thread(target=self._warm, args=(generation,), name="ChatPrewarmThread", daemon=True).start()
+
+    def _warm(self, generation):
+        opening = None
+        try:
+            if PREGENERATE_OPENING:
+                opening = generate_opening_message(priority=DETECTION) or None
+            else:
+                prefill_system_prompt(priority=DETECTION)
+        except InferenceNotRun as e:
+            logging.info(f"Chat warm-up skipped by the inference scheduler: {e}")
+            return
+        except (RuntimeError, OSError) as e:
+            logging.error(f"Chat warm-up failed: {e}")
+            with self.lock:
+                self.counts['failed'] += 1
+            return
+
+        with self.lock:
+            if generation != self.generation:
+                logging.info("Chat warm-up finished after it was discarded or superseded; dropping it.")
+                return
+            self.ready = True
+            self.opening = opening
+            self.counts['ready'] += 1
+        logging.info(f"Chat model warmed; opening message: {opening}")
+
+    def discard(self):
+        """
+        Drop any finished or in-flight warm-up, e.g. when the user denies the chat invitation.
+        """
+        with self.lock:
+            self.generation += 1
+            if self.ready:
+                self.counts['discarded'] += 1
+            self.ready = False
+            self.opening = None
+
+    def take(self):
+        """
+        Returns the opening message from a finished warm-up, or None.
+        A warm-up still in flight is dropped.
+        """
+        with self.lock:
+            self.generation += 1
+            opening = self.opening
+            if self.ready:
+                self.counts['used'] += 1
+            self.ready = False
+            self.opening = None
+        return opening
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts)
+
+chat_prewarm = ChatPrewarm()
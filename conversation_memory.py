@@ -0,0 +1,114 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from prompt_builder import estimate_tokens
+
+# Turns always kept verbatim; older turns are folded into the rolling summary.
+RECENT_TURNS = 4
+# Fold older turns into the summary once the kept turns exceed this many estimated tokens.
+SUMMARY_TRIGGER_TOKENS = 400
+# Hard cap on kept turns, in case summarization falls behind or keeps failing.
+MAX_TURNS = 32
+# Sessions untouched for this long are dropped.
+SESSION_IDLE_SECONDS = 60 * 60 * 6
+
+summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ConversationSummary")
+
+class ConversationMemory:
+    """
+    One chat session's history: a bounded window of recent turns plus a rolling summary of
+    everything older. summarizer(previous_summary, [(speaker, text), ...]) returns the new summary
+    and runs in the background so replies never wait on it.
+    """
+
+    def __init__(self, summarizer):
+        self.summarizer = summarizer
+        self.turns = deque(maxlen=MAX_TURNS)  # (sequence number, speaker, text)
+        self.summary = ''
+        self.next_sequence = 0
+        self.summarizing = False
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.turns)
+
+    def add_turn(self, speaker, text):
+        with self.lock:
+            self.turns.append((self.next_sequence, speaker, text))
+            self.next_sequence += 1
+            self.last_used = time.monotonic()
+            fold = self._turns_to_fold()
+            if fold:
+                self.summarizing = True
+                previous_summary = self.summary
+        if fold:
+            summary_executor.submit(self._fold, previous_summary, fold)
+
+    def _turns_to_fold(self):
+        if self.summarizing or len(self.turns) <= RECENT_TURNS:
+            return []
+        if sum(estimate_tokens(text) for _, _, text in self.turns) <= SUMMARY_TRIGGER_TOKENS:
+            return []
+        return list(self.turns)[:-RECENT_TURNS]
+
+    def _fold(self, previous_summary, fold):
+        try:
+            summary = self.summarizer(previous_summary, [(speaker, text) for _, speaker, text in fold])
+        except Exception as e:
+            logging.error(f"Rolling conversation summary failed: {e}", exc_info=True)
+            summary = None
+        with self.lock:
+            self.summarizing = False
+            if summary is None:
+                return
+            self.summary = summary.strip()
+            last_folded = fold[-1][0]
+            while self.turns and self.turns[0][0] <= last_folded:
+                self.turns.popleft()
+        logging.info(f"Folded {len(fold)} turns into the rolling conversation summary.")
+
+    def context(self):
+        """
+        Returns (rolling summary, [(speaker, text), ...] recent turns, oldest first).
+        """
+        with self.lock:
+            self.last_used = time.monotonic()
+            return self.summary, [(speaker, text) for _, speaker, text in self.turns]
+
+    def transcript(self):
+        """
+        The whole conversation as far as it is remembered, for the end-of-chat summary.
+        """
+        summary, turns = self.context()
+        if summary:
+            turns.insert(0, ("Earlier conversation (summary)", summary))
+        return turns
+
+class ConversationSessions:
+    """
+    ConversationMemory per conversation key (Flask session conversation id or Socket.IO sid).
+    """
+
+    def __init__(self, summarizer):
+        self.summarizer = summarizer
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self.lock:
+            for idle_key in [k for k, memory in self.sessions.items() if now - memory.last_used > SESSION_IDLE_SECONDS]:
+                del self.sessions[idle_key]
+            memory = self.sessions.get(key)
+            if memory is None:
+                memory = self.sessions[key] = ConversationMemory(self.summarizer)
+            return memory
+
+    def end(self, key):
+        with self.lock:
+            self.sessions.pop(key, None)
@@ -1,68 +1,87 @@
+import logging
 import re
-import sqlite3
-import subprocess
 
-LLAMA_CPP_PATH = "/Users/seanzhang/llama.cpp/build/bin/llama-run"
+import llm_runtime
+from inference_scheduler import CHAT, SUMMARY, inference_scheduler
+from knowledge_store import KnowledgeStore
+from prompt_builder import estimate_tokens, fit_entries, record_prompt, truncate_to_budget
+
 MODEL_PATH = "/Users/seanzhang/llama.cpp/models/Meta-Llama-3.1-8B-Instruct-IQ2_M.gguf"
 SUMMARY_MODEL_PATH = "/Users/seanzhang/llama.cpp/models/Meta-Llama-3.1-8B-Instruct-IQ2_M.gguf"
 
+# Number of knowledge entries placed in the chat prompt, chosen by relevance to the user's message.
+KNOWLEDGE_TOP_K = 5
+
+# Token budgets for the parts of a chat prompt; CHAT_CONTEXT_SIZE is derived from them.
+SYSTEM_PROMPT_TOKEN_BUDGET = 220  # fixed instructions plus section headers (~210 estimated)
+KNOWLEDGE_TOKEN_BUDGET = 150
+HISTORY_SUMMARY_TOKEN_BUDGET = 100
+RECENT_TURNS_TOKEN_BUDGET = 250
+USER_INPUT_TOKEN_BUDGET = 150
+# Reply length asked for in the instructions, and the hard cap on generated tokens; the cap
+# leaves headroom because the model does not count tokens exactly.
+CHAT_REPLY_TARGET_TOKENS = 300
+CHAT_MAX_NEW_TOKENS = 400
+CHAT_CONTEXT_SIZE = (
+    SYSTEM_PROMPT_TOKEN_BUDGET + KNOWLEDGE_TOKEN_BUDGET + HISTORY_SUMMARY_TOKEN_BUDGET
+    + RECENT_TURNS_TOKEN_BUDGET + USER_INPUT_TOKEN_BUDGET + CHAT_MAX_NEW_TOKENS
+)
+SUMMARY_CONTEXT_SIZE = 3072
+OPENING_MESSAGE_MAX_TOKENS = 80
+
+# Shown when no pre-generated opening message is ready.
+DEFAULT_OPENING_MESSAGE = (
+    "Hi, I've noticed you might be having trouble focusing. "
+    "Could you tell me what's on your mind?"
+)
+
+knowledge_store = KnowledgeStore()
+
+# Chat and summaries load the same GGUF file; start its server once with room for both.
+llm_runtime.reserve_context(MODEL_PATH, CHAT_CONTEXT_SIZE)
+llm_runtime.reserve_context(SUMMARY_MODEL_PATH, SUMMARY_CONTEXT_SIZE)
+
 def retrieve_all_knowledge():
     """
     Returns all knowledge entries as a list of content strings.
     """
-    conn = sqlite3.connect('knowledge_base.db')
-    cursor = conn.cursor()
-
-    cursor.execute('SELECT content FROM knowledge')
-    knowledge_entries = cursor.fetchall()
-    conn.close()
-    return [entry[0] for entry in knowledge_entries]
+    return [entry[1] for entry in knowledge_store.entries()]
 
 def retrieve_all_knowledge_with_ids():
     """
     Returns all knowledge entries as a list of (id, content) tuples.
     """
-    conn = sqlite3.connect('knowledge_base.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, content FROM knowledge')
-    rows = cursor.fetchall()
-    conn.close()
-    return rows
+    return knowledge_store.entries()
+
+def retrieve_relevant_knowledge(query, k=KNOWLEDGE_TOP_K):
+    """
+    Returns the contents of the k knowledge entries most relevant to query.
+    """
+    return knowledge_store.search(query, k)
 
 def knowledge_count():
     """
     Returns the total number of entries in the knowledge base.
     """
-    conn = sqlite3.connect('knowledge_base.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT COUNT(*) FROM knowledge')
-    count = cursor.fetchone()[0]
-    conn.close()
-    return count
+    return knowledge_store.count()
 
 def insert_knowledge_entry(content):
     """
-    Inserts a single row of knowledge content. 
-    Category column is unused, so store 'N/A' or blank.
+    Inserts a single row of knowledge content.
     """
-    conn = sqlite3.connect('knowledge_base.db')
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO knowledge (content, category) VALUES (?, ?)",
-        (content, "N/A")
-    )
-    conn.commit()
-    conn.close()
+    knowledge_store.insert_many([content])
 
 def delete_knowledge_by_id(knowledge_id):
     """
     Deletes a single knowledge entry by its numeric id.
     """
-    conn = sqlite3.connect('knowledge_base.db')
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM knowledge WHERE id = ?", (knowledge_id,))
-    conn.commit()
-    conn.close()
+    knowledge_store.delete_many([knowledge_id])
+
+def replace_knowledge_entries(delete_ids, new_contents):
+    """
+    Deletes several knowledge entries and inserts new ones in one transaction.
+    """
+    knowledge_store.replace(delete_ids, new_contents)
 
 def strip_ansi_escape_codes(text):
     """
@@ -71,56 +90,129 @@ def strip_ansi_escape_codes(text):
     ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
     return ansi_escape.sub('', text)
 
-def generate_personalized_response(user_input, knowledge_entries):
-    # Build the prompt
-    prompt = (
-        "You are an assistant helping the user improve their productivity.\n"
-        "The user has experienced decreased productivity recently.\n"
+def fit_recent_turns(turns, token_budget):
+    """
+    Keep the newest turns that fit token_budget, returned oldest first.
+    """
+    kept = []
+    used = 0
+    for speaker, text in reversed(turns):
+        line = f"{speaker}: {text}"
+        cost = estimate_tokens(line)
+        if used + cost > token_budget:
+            break
+        kept.append(line)
+        used += cost
+    kept.reverse()
+    return kept, len(turns) - len(kept)
+
+def build_system_prompt():
+    """
+    Static head of every chat prompt: the instructions and rules only. It is the same for every
+    message of every conversation, so the server can reuse its prefilled KV state; the knowledge
+    entries, history and user turn are retrieved per message and follow it.
+    """
+    return (
+        f"You are an assistant helping the user improve their productivity.\n"
+        f"The user has experienced decreased productivity recently.\n"
+        f"Engage/Respond to the user in one single response to help them get back on track. "
+        f"Only respond as the Assistant. Do not include any text for the user. "
+        f"Your complete response must be under {CHAT_REPLY_TARGET_TOKENS} tokens. "
+        f"If the user indicates a desire to end the conversation or go leave to do work, "
+        f"then end with a concluding remark that includes one authentic relevant Chinese proverb, "
+        f"in both authentic Mandarin Chinese characters and pinyin.\n"
     )
+
+def build_personalized_prompt(user_input, knowledge_entries, history=None):
+    """
+    Builds the chat prompt from the user's message, stored knowledge entries and the
+    conversation so far (history is (rolling summary, recent turns) from ConversationMemory),
+    keeping each within its token budget. The system prompt comes first so it can be prefix-cached.
+    """
+    knowledge_entries, dropped = fit_entries(knowledge_entries, KNOWLEDGE_TOKEN_BUDGET)
+    user_input = truncate_to_budget(user_input, USER_INPUT_TOKEN_BUDGET)
+    summary, turns = history or ('', [])
+    recent_lines, turns_dropped = fit_recent_turns(turns, RECENT_TURNS_TOKEN_BUDGET)
+
+    prompt = build_system_prompt()
     if knowledge_entries:
         prompt += (
-            "Here are some key facts to keep in mind about the user, "
+            "\nHere are some key facts to keep in mind about the user, "
             "such as their traits, habits, and situation:\n"
         )
         for entry in knowledge_entries:
             prompt += f"- {entry}\n"
-    prompt += (
-        f"\nEngage/Respond to the user in one single response to help them get back on track. "
-        f"Only respond as the Assistant. Do not include any text for the user. "
-        f"Your complete response must be under 500 tokens. "
-        f"If the user indicates a desire to end the conversation or go leave to do work, "
-        f"then end with a concluding remark that includes one authentic relevant Chinese proverb, "
-        f"in both authentic Mandarin Chinese characters and pinyin.\n\n"
-        f"User: {user_input}\nAssistant:"
-    )
+    if summary:
+        prompt += f"\nSummary of the conversation so far: {truncate_to_budget(summary, HISTORY_SUMMARY_TOKEN_BUDGET)}\n"
+    if recent_lines:
+        prompt += "\nRecent conversation:\n" + "\n".join(recent_lines) + "\n"
+    prompt += f"\nUser: {user_input}\nAssistant:"
+    record_prompt('chat', prompt, dropped + turns_dropped)
+    return prompt
 
-    print(f"CONVERSATIONAL AGENT: GENERATING RESPONSE for prompt: {prompt}")
+def clean_assistant_reply(response):
+    """
+    Strips escape codes and any echoed 'Assistant:' prefix from raw model output.
+    """
+    response_cleaned = strip_ansi_escape_codes(response.strip())
 
-    result = subprocess.run(
-        [
-            LLAMA_CPP_PATH,
-            "-m", MODEL_PATH,
-            "-p", prompt,
-            "-c", "900",
-            "-ngl", "1"
-        ],
-        capture_output=True,
-        text=True
-    )
+    if "Assistant:" in response_cleaned:
+        return response_cleaned.split('Assistant:')[-1].strip()
+    return response_cleaned.strip()
 
-    response = result.stdout.strip()
-    response_cleaned = strip_ansi_escape_codes(response)
+def generate_personalized_response(user_input, knowledge_entries, history=None):
+    prompt = build_personalized_prompt(user_input, knowledge_entries, history)
 
-    if "Assistant:" in response_cleaned:
-        assistant_reply = response_cleaned.split('Assistant:')[-1].strip()
-    else:
-        assistant_reply = response_cleaned.strip()
+    print(f"CONVERSATIONAL AGENT: GENERATING RESPONSE for prompt: {prompt}")
 
-    print(f"CONVERSATIONAL AGENT: RESPONSE = {response_cleaned}")
+    with inference_scheduler.slot(CHAT):
+        response = llm_runtime.complete(
+            MODEL_PATH, prompt, n_ctx=CHAT_CONTEXT_SIZE, n_predict=CHAT_MAX_NEW_TOKENS, cache_prompt=True
+        )
+    assistant_reply = clean_assistant_reply(response)
+
+    print(f"CONVERSATIONAL AGENT: RESPONSE = {response}")
     print(f"CONVERSATIONAL AGENT: REPLY = {assistant_reply}")
 
     return assistant_reply
 
+def stream_personalized_response(user_input, knowledge_entries, history=None):
+    """
+    Yields the assistant reply piece by piece as the model generates it.
+    Callers should pass the joined pieces through clean_assistant_reply for the final text.
+    """
+    prompt = build_personalized_prompt(user_input, knowledge_entries, history)
+
+    logging.debug(f"Streaming chat response for prompt: {prompt}")
+
+    # The slot is held until the last piece is generated.
+    with inference_scheduler.slot(CHAT):
+        yield from llm_runtime.stream(
+            MODEL_PATH, prompt, n_ctx=CHAT_CONTEXT_SIZE, n_predict=CHAT_MAX_NEW_TOKENS, cache_prompt=True
+        )
+
+def prefill_system_prompt(priority=CHAT):
+    """
+    Load the chat model and prefill the system prompt without generating anything.
+    """
+    with inference_scheduler.slot(priority):
+        llm_runtime.get_runtime(MODEL_PATH, CHAT_CONTEXT_SIZE).request(build_system_prompt(), n_predict=0, cache_prompt=True)
+
+def generate_opening_message(priority=CHAT):
+    """
+    Opening assistant message for a new conversation, generated after the same system prompt
+    as the replies that follow so its prefilled state is reused by the first reply.
+    """
+    prompt = (
+        f"{build_system_prompt()}\nStart the conversation: in one or two friendly sentences, let the user know "
+        f"you noticed they may be having trouble focusing and ask what is on their mind.\nAssistant:"
+    )
+    with inference_scheduler.slot(priority):
+        response = llm_runtime.complete(
+            MODEL_PATH, prompt, n_ctx=CHAT_CONTEXT_SIZE, n_predict=OPENING_MESSAGE_MAX_TOKENS, cache_prompt=True
+        )
+    return clean_assistant_reply(response)
+
 def summarize_conversation(conversation_history):
     print(f"Summary: Conversation History: {conversation_history}")
 
@@ -141,19 +233,8 @@ def summarize_conversation(conversation_history):
         f"{conversation_text}\n\nSummary:"
     )
     print("CONVERSATIONAL AGENT: SUMMARIZING CONVERSATION")
-    result = subprocess.run(
-        [
-            LLAMA_CPP_PATH,
-            "-m", SUMMARY_MODEL_PATH,
-            "-p", prompt,
-            "-c", "3072",
-            "-ngl", "1"
-        ],
-        capture_output=True,
-        text=True
-    )
-
-    response = result.stdout.strip()
+    with inference_scheduler.slot(SUMMARY):
+        response = llm_runtime.complete(SUMMARY_MODEL_PATH, prompt, n_ctx=SUMMARY_CONTEXT_SIZE).strip()
     response_cleaned = strip_ansi_escape_codes(response)
 
     if "Summary:" in response_cleaned:
@@ -161,4 +242,21 @@ def summarize_conversation(conversation_history):
     else:
         summary_text = response_cleaned.strip()
     print(f"SUMMARY WRITTEN: {summary_text}")
-    return summary_text
\ No newline at end of file
+    return summary_text
+
+def summarize_history(previous_summary, turns):
+    """
+    Rolling summary for ConversationMemory: folds older turns into the running summary
+    so the chat prompt keeps earlier context at a fixed size.
+    """
+    conversation_text = ''.join(f"{speaker}: {text}\n" for speaker, text in turns)
+    prompt = (
+        "Update the running summary of a conversation between a user and a productivity assistant "
+        "with the new messages below. Keep what the user said about their goals, problems and plans, "
+        "and what the assistant suggested. Your complete response must be under 80 tokens.\n\n"
+        f"Running summary: {previous_summary or '(none yet)'}\n\n"
+        f"New messages:\n{conversation_text}\nUpdated summary:"
+    )
+    with inference_scheduler.slot(SUMMARY):
+        response = llm_runtime.complete(SUMMARY_MODEL_PATH, prompt, n_ctx=SUMMARY_CONTEXT_SIZE, n_predict=120)
+    return strip_ansi_escape_codes(response).split('Updated summary:')[-1].strip()
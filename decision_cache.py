@@ -0,0 +1,75 @@
+import bisect
+import threading
+import time
+from collections import OrderedDict
+
+DECISION_CACHE_SIZE = 128
+DECISION_CACHE_TTL = 60 * 15
+# Titles with less time than this do not change the fingerprint.
+MIN_FINGERPRINT_SECONDS = 5
+# Duration bin edges in seconds. 60 is an edge so the 60s detection condition never falls inside a bin.
+DURATION_BINS = (5, 15, 30, 60, 120, 300, 600, 1200)
+
+def canonical_durations(durations):
+    """
+    Order-independent form of a per-title durations dict: lowercased titles with
+    their durations bucketed into DURATION_BINS.
+    """
+    return tuple(sorted(
+        (title.strip().lower(), bisect.bisect_right(DURATION_BINS, duration))
+        for title, duration in durations.items()
+        if duration >= MIN_FINGERPRINT_SECONDS and title.strip()
+    ))
+
+def activity_fingerprint(recent_logs, context_logs):
+    """
+    Cache key for a detection input; equivalent activity states map to the same key.
+    """
+    return (canonical_durations(recent_logs), canonical_durations(context_logs))
+
+class DecisionCache:
+    """
+    LRU cache of detection decisions keyed on activity fingerprints, with a TTL
+    so stale decisions are re-evaluated.
+    """
+
+    def __init__(self, max_entries=DECISION_CACHE_SIZE, ttl=DECISION_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # fingerprint -> (stored_at, decision)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, fingerprint):
+        """
+        Returns the cached decision for fingerprint, or None on a miss or expiry.
+        """
+        with self.lock:
+            cached = self.entries.get(fingerprint)
+            if cached is not None and time.monotonic() - cached[0] > self.ttl:
+                del self.entries[fingerprint]
+                cached = None
+            if cached is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(fingerprint)
+            self.hits += 1
+            return cached[1]
+
+    def put(self, fingerprint, decision):
+        with self.lock:
+            self.entries[fingerprint] = (time.monotonic(), decision)
+            self.entries.move_to_end(fingerprint)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self.entries)
+            }
@@ -1,10 +1,83 @@
-import subprocess
 import re
+import json
+import logging
+import threading
+import time
 from collections import defaultdict
+from functools import lru_cache
+
+import llm_runtime
+from inference_scheduler import DETECTION, InferenceNotRun, inference_scheduler
+from activity_store import DECISION_RETENTION_ROWS, activity_store
+from cascade_classifier import CascadeClassifier
+from decision_cache import DecisionCache, activity_fingerprint
+from metrics import LatencyStats
+from prompt_builder import fit_durations, record_prompt
+from title_normalizer import CATEGORY_PATTERNS, TITLE_CACHE_SIZE, clean_title, compile_site_matcher
 
-LLAMA_CPP_PATH = "/Users/seanzhang/llama.cpp/build/bin/llama-run"
 MODEL_PATH = "/Users/seanzhang/llama.cpp/models/Meta-Llama-3.1-8B-Instruct-Q3_K_L.gguf"
 DISTRACTING_SITES = ["YouTube", "Instagram", "Reddit", "Linkedin"]
+MIN_DISTRACTION_SECONDS = 60
+DETECTION_CONTEXT_SIZE = 1792
+# Token budgets for the variable logs, so busy windows cannot overflow the context or bloat prefill.
+RECENT_LOGS_TOKEN_BUDGET = 250
+CONTEXT_LOGS_TOKEN_BUDGET = 400
+MAX_PROMPT_TITLES = 20
+
+# 'structured' constrains generation with a GBNF grammar to {"reason": ..., "decision": true|false};
+# 'text' lets the model write free text ending in "Decision: TRUE/FALSE".
+DETECTION_OUTPUT_MODE = 'structured'
+MAX_REASON_CHARS = 160
+# Longest output DETECTION_GRAMMAR allows. The reason is printable ASCII, and Llama 3's byte-level
+# tokenizer never spends more than one token on an ASCII character, so this many tokens always
+# fits a complete grammar output.
+MAX_STRUCTURED_OUTPUT_CHARS = len('{"reason": "", "decision": false}') + MAX_REASON_CHARS
+# Hard cap on generated tokens per detection.
+MAX_NEW_TOKENS = {'structured': MAX_STRUCTURED_OUTPUT_CHARS, 'text': 128}
+
+# Cascade: a Naive Bayes classifier trained on logged LLM decisions answers clear-cut cases;
+# predictions whose calibrated confidence is below CASCADE_CONFIDENCE go on to the LLM.
+CASCADE_ENABLED = True
+CASCADE_CONFIDENCE = 0.9
+CASCADE_MIN_SAMPLES_PER_CLASS = 100
+CASCADE_TRAINING_WINDOW = DECISION_RETENTION_ROWS
+CASCADE_RETRAIN_EVERY = 10
+
+DETECTION_GRAMMAR = r'''
+root ::= "{\"reason\": \"" reason "\", \"decision\": " decision "}"
+reason ::= [ !#-\x5B\x5D-~]{1,%d}
+decision ::= "true" | "false"
+''' % MAX_REASON_CHARS
+# Keep the KV state of the static system prompt resident so each call only prefills the logs.
+PROMPT_CACHE = True
+
+DETECTION_SYSTEM_PROMPT = (
+    "You are an assistant tasked with analyzing user activity logs for productivity interventions. Your goal is to determine whether an intervention is required to help the user regain focus. \n"
+    f"The only intervention-worthy distracting activities are: {DISTRACTING_SITES}. \n"
+    f"Logs are recorded in seconds. A necessary, but not sufficient, condition for intervention is at least {MIN_DISTRACTION_SECONDS} seconds spent on a distracting activity listed in {DISTRACTING_SITES} recorded in the recent logs. \n"
+    "Do not hallucinate or make up activities that are not in either the recent or context logs. For the sake of double-checking, you must cite any intervention-worthy violation activity with its exact name, duration and neighboring activites. \n"
+)
+OUTPUT_FORMAT_INSTRUCTIONS = {
+    'text': "Output a one-sentence explanation, followed by exactly one word: 'TRUE' if based on the prior criteria an intervention is needed, or 'FALSE' otherwise. The format should be: \"[sentence]. Decision: [decision]\"",
+    'structured': "Output a JSON object with a one-sentence \"reason\" and a boolean \"decision\": true if based on the prior criteria an intervention is needed, or false otherwise."
+}
+PROMPT_TAILS = {'text': "\n Decision: ", 'structured': "\n Response: "}
+DETECTION_SYSTEM_PROMPT += OUTPUT_FORMAT_INSTRUCTIONS[DETECTION_OUTPUT_MODE]
+# Everything before the variable logs; identical on every call, so its KV state can be reused.
+DETECTION_PROMPT_PREFIX = f"{DETECTION_SYSTEM_PROMPT}\n\nRecent Logs:\n"
+DETECTION_PREFIX_CACHE_NAME = llm_runtime.prefix_cache_name("detection", MODEL_PATH, DETECTION_PROMPT_PREFIX)
+
+# How often the rule-based fast path or the decision cache answered without running the model.
+detection_stats = {'calls': 0, 'llm_invocations': 0, 'llm_skipped': 0, 'cache_hits': 0, 'classifier_decisions': 0, 'parse_failures': 0}
+detection_stats_lock = threading.Lock()
+# Per-tier ('fast_path', 'cache', 'classifier', 'llm') latency of answered detections.
+tier_latency = LatencyStats()
+
+# Site segment of a raw title -> DISTRACTING_SITES entry, with title_normalizer's anchoring rules.
+match_distracting_segment = compile_site_matcher({site: CATEGORY_PATTERNS[site] for site in DISTRACTING_SITES})
+
+# Reuses decisions for equivalent activity states.
+decision_cache = DecisionCache()
 
 def strip_ansi_escape_codes(text):
     """
@@ -27,49 +100,220 @@ def condense_activity_durations(data):
 
     return dict(condensed_data)
 
-def detection_llm(aggregated_data_entry, running_context_entries):
+@lru_cache(maxsize=TITLE_CACHE_SIZE)
+def match_distracting_site(title):
+    """
+    The DISTRACTING_SITES entry a title belongs to, or None. Normalized titles are the category
+    name itself; raw titles only count when their site segment is the site, so
+    "youtube-dl/README.md - VS Code" is not YouTube.
+    """
+    if title in DISTRACTING_SITES:
+        return title
+    return match_distracting_segment(clean_title(title))
+
+def distracting_site_durations(durations):
+    """
+    Sum seconds per DISTRACTING_SITES entry the titles belong to (see match_distracting_site).
+    """
+    site_durations = defaultdict(float)
+    for title, duration in durations.items():
+        site = match_distracting_site(title)
+        if site is not None:
+            site_durations[site] += duration
+    return dict(site_durations)
+
+def passes_prefilter(recent_logs, context_logs):
+    """
+    Deterministic check of the prompt's necessary condition: at least MIN_DISTRACTION_SECONDS
+    on a single distracting site in the recent logs. Context logs alone can never satisfy it.
+    Returns True if the model still has to decide, False if the answer is certainly FALSE.
+    """
+    recent_sites = distracting_site_durations(recent_logs)
+    if any(duration >= MIN_DISTRACTION_SECONDS for duration in recent_sites.values()):
+        return True
+
+    context_sites = distracting_site_durations(context_logs)
+    logging.info(
+        f"Fast path: no distracting site reached {MIN_DISTRACTION_SECONDS}s in recent logs "
+        f"(recent: {recent_sites}, context: {context_sites})."
+    )
+    return False
+
+STAT_KEYS = {'fast_path': 'llm_skipped', 'cache': 'cache_hits', 'classifier': 'classifier_decisions', 'llm': 'llm_invocations'}
+
+def record_detection(source, started):
+    """
+    Count one detection call answered by source ('fast_path', 'cache', 'classifier' or 'llm')
+    and its latency since started (a time.perf_counter() value).
+    """
+    latency_ms = (time.perf_counter() - started) * 1000
+    with detection_stats_lock:
+        detection_stats['calls'] += 1
+        detection_stats[STAT_KEYS[source]] += 1
+        stats = dict(detection_stats)
+    tier_latency.record(source, latency_ms)
+    logging.info(
+        f"Detection answered by {source} in {latency_ms:.1f} ms. "
+        f"LLM skipped {stats['llm_skipped']}/{stats['calls']} calls "
+        f"({100.0 * stats['llm_skipped'] / stats['calls']:.1f}%), "
+        f"{stats['cache_hits']} answered from the decision cache, "
+        f"{stats['classifier_decisions']} by the classifier."
+    )
+
+def get_detection_stats():
+    """
+    Returns a copy of the detection counters plus the fraction of calls answered without the LLM,
+    and the decision cache's hit/miss counters.
+    """
+    with detection_stats_lock:
+        stats = dict(detection_stats)
+    stats['tiers'] = tier_latency.snapshot()
+    stats['skip_rate'] = stats['llm_skipped'] / stats['calls'] if stats['calls'] else 0.0
+    stats['decision_cache'] = decision_cache.stats()
+    return stats
+
+# Labelled LLM decisions since the classifier was last trained; None until the first training.
+cascade_classifier = CascadeClassifier(distracting_site_durations)
+cascade_state = {'new_labels': None}
+
+def classify_with_cascade(recent_logs, context_logs):
+    """
+    First model tier. Retrains from the logged LLM decisions every CASCADE_RETRAIN_EVERY new labels.
+    Returns the classifier's decision if it is trained and at least CASCADE_CONFIDENCE sure, else None.
+    """
+    new_labels = cascade_state['new_labels']
+    if new_labels is None or new_labels >= CASCADE_RETRAIN_EVERY:
+        samples = activity_store.labeled_decisions('llm', CASCADE_TRAINING_WINDOW)
+        cascade_classifier.train(samples)
+        cascade_state['new_labels'] = 0
+        logging.info(f"Cascade classifier trained on {len(samples)} logged LLM decisions.")
+
+    if not cascade_classifier.is_trained(CASCADE_MIN_SAMPLES_PER_CLASS):
+        return None
+    decision, confidence = cascade_classifier.predict(recent_logs, context_logs)
+    if decision is None:
+        logging.info("Cascade classifier has not seen this kind of activity; escalating to the LLM.")
+        return None
+    logging.info(f"Cascade classifier: {decision} with calibrated confidence {confidence:.3f}.")
+    return decision if confidence >= CASCADE_CONFIDENCE else None
+
+def is_distracting(title):
+    return match_distracting_site(title) is not None
+
+def compact_detection_logs(recent_logs, context_logs):
+    """
+    Fit both logs into their token budgets: top titles by duration, the long tail rolled
+    into 'other', whole seconds. Distracting titles are always kept.
+    Returns (recent, context, number of titles rolled up).
+    """
+    recent_compact, recent_rolled = fit_durations(recent_logs, RECENT_LOGS_TOKEN_BUDGET, MAX_PROMPT_TITLES, keep=is_distracting)
+    context_compact, context_rolled = fit_durations(context_logs, CONTEXT_LOGS_TOKEN_BUDGET, MAX_PROMPT_TITLES, keep=is_distracting)
+    return recent_compact, context_compact, recent_rolled + context_rolled
+
+def build_detection_prompt(recent_logs, context_logs):
+    """
+    Full detection prompt: the static prefix followed by the variable Recent/Context logs tail.
+    """
+    return f"{DETECTION_PROMPT_PREFIX}{recent_logs}\n\nContext Logs:\n{context_logs}{PROMPT_TAILS[DETECTION_OUTPUT_MODE]}"
+
+def run_detection_inference(input_text):
+    """
+    Send the detection prompt to the resident model, reusing the cached static prefix when enabled.
+    Generation is capped at MAX_NEW_TOKENS and, in structured mode, constrained by DETECTION_GRAMMAR.
+    Runs at the lowest inference priority; raises InferenceNotRun if the scheduler drops it.
+    """
+    options = {'cache_prompt': PROMPT_CACHE}
+    if DETECTION_OUTPUT_MODE == 'structured':
+        options['grammar'] = DETECTION_GRAMMAR
+    with inference_scheduler.slot(DETECTION):
+        runtime = llm_runtime.get_runtime(MODEL_PATH, DETECTION_CONTEXT_SIZE)
+        if PROMPT_CACHE:
+            runtime.warm_prefix(DETECTION_PROMPT_PREFIX, DETECTION_PREFIX_CACHE_NAME)
+        return runtime.complete(input_text, n_predict=MAX_NEW_TOKENS[DETECTION_OUTPUT_MODE], **options)
+
+def parse_decision(output_text):
+    """
+    Extract 'TRUE' or 'FALSE' from the model output. Returns None if it cannot be parsed.
+    """
+    if DETECTION_OUTPUT_MODE == 'structured':
+        try:
+            parsed = json.loads(output_text)
+        except ValueError:
+            return None
+        if not isinstance(parsed, dict) or not isinstance(parsed.get('decision'), bool):
+            return None
+        logging.info(f"Detection reason: {parsed.get('reason')}")
+        return 'TRUE' if parsed['decision'] else 'FALSE'
+
+    decision_line = output_text.split('Decision: ')[-1].strip()
+    if decision_line:
+        match = re.search(r'\b(TRUE|FALSE)\b', decision_line, re.IGNORECASE)
+        if match:
+            return match.group(1).upper()
+    return None
+
+def detection_llm(aggregated_data_entry, context_logs):
     """
     Analyze aggregated logs using the quantized Llama model (via llama.cpp) to detect distractions.
+    context_logs is the condensed per-activity context, e.g. from log_watcher.running_context.snapshot().
     Returns "TRUE" if intervention is needed, "FALSE" otherwise.
     """
     print("DETECTION LLM FUNCTION CALLED ...")
-    system_prompt = (
-        "You are an assistant tasked with analyzing user activity logs for productivity interventions. Your goal is to determine whether an intervention is required to help the user regain focus. \n"
-        f"The only intervention-worthy distracting activities are: {DISTRACTING_SITES}. \n"
-        f"Logs are recorded in seconds. A necessary, but not sufficient, condition for intervention is at least 60 seconds spent on a distracting activity listed in {DISTRACTING_SITES} recorded in the recent logs. \n"
-        "Do not hallucinate or make up activities that are not in either the recent or context logs. For the sake of double-checking, you must cite any intervention-worthy violation activity with its exact name, duration and neighboring activites. \n"
-        "Output a one-sentence explanation, followed by exactly one word: 'TRUE' if based on the prior criteria an intervention is needed, or 'FALSE' otherwise. The format should be: \"[sentence]. Decision: [decision]\""
-    )
-
+    started = time.perf_counter()
     recent_logs = aggregated_data_entry['data']
-    context_logs = condense_activity_durations([entry['data'] for entry in running_context_entries])
+    context_logs = dict(context_logs)
+
+    if not passes_prefilter(recent_logs, context_logs):
+        record_detection('fast_path', started)
+        return 'FALSE'
+
+    fingerprint = activity_fingerprint(recent_logs, context_logs)
+    cached_decision = decision_cache.get(fingerprint)
+    if cached_decision is not None:
+        record_detection('cache', started)
+        logging.info(f"Reusing cached detection decision: {cached_decision}")
+        return cached_decision
 
-    input_text = f"{system_prompt}\n\nRecent Logs:\n{recent_logs}\n\nContext Logs:\n{context_logs}\n Decision: "
+    if CASCADE_ENABLED:
+        classifier_decision = classify_with_cascade(recent_logs, context_logs)
+        if classifier_decision is not None:
+            activity_store.record_decision(recent_logs, context_logs, classifier_decision, 'classifier')
+            record_detection('classifier', started)
+            return classifier_decision
+
+    recent_compact, context_compact, rolled_up = compact_detection_logs(recent_logs, context_logs)
+    input_text = build_detection_prompt(recent_compact, context_compact)
+    prompt_tokens = record_prompt('detection', input_text, rolled_up)
+    logging.info(f"Detection prompt: ~{prompt_tokens} tokens, {rolled_up} titles rolled into 'other'.")
 
     print(f"GENERATING OUTPUT for INPUT: \n {input_text}")
-    result = subprocess.run(
-        [
-            LLAMA_CPP_PATH,
-            "-m", MODEL_PATH,
-            "-p", input_text,
-            "-c", "1792",
-            "-ngl", "1"
-        ],
-        capture_output=True,
-        text=True
-    )
-    output_text = result.stdout.strip()
+    try:
+        output_text = run_detection_inference(input_text).strip()
+    except InferenceNotRun as e:
+        logging.info(f"Detection skipped by the inference scheduler: {e}")
+        return 'FALSE'
+    except (RuntimeError, OSError) as e:
+        logging.error(f"Detection LLM inference failed: {e}")
+        output_text = ''
 
     output_text = strip_ansi_escape_codes(output_text)
     print("OUTPUT GENERATED")
     print(f"Output from (1) detection LLM: {output_text}")
 
-    decision_line = output_text.split('Decision: ')[-1].strip()
+    decision = parse_decision(output_text)
+    record_detection('llm', started)
 
-    decision = None
-    if decision_line:
-        match = re.search(r'\b(TRUE|FALSE)\b', decision_line, re.IGNORECASE)
-        if match: decision = match.group(1).upper()
+    # Only remember decisions the model actually made, not fallbacks from failed runs.
+    if decision is not None:
+        decision_cache.put(fingerprint, decision)
+        activity_store.record_decision(recent_logs, context_logs, decision, 'llm')
+        if cascade_state['new_labels'] is not None:
+            cascade_state['new_labels'] += 1
+    else:
+        with detection_stats_lock:
+            detection_stats['parse_failures'] += 1
+            parse_failures = detection_stats['parse_failures']
+        logging.warning(f"Could not parse a detection decision (parse failure #{parse_failures}); treating as FALSE.")
 
     if decision == 'TRUE':
         return 'TRUE'
@@ -0,0 +1,74 @@
+import logging
+import threading
+import time
+
+from detection_llm import distracting_site_durations
+
+# New distracting seconds that must arrive before a detection is worth running.
+TRIGGER_DISTRACTION_SECONDS = 20
+# Wait this long after the latest aggregate before running, so bursts (e.g. a backfill) coalesce.
+DEBOUNCE_SECONDS = 5
+# Never run detection more often than this.
+MIN_INTERVAL_SECONDS = 60
+
+class DetectionScheduler:
+    """
+    Triggers detection from new aggregates instead of a fixed timer.
+    log_watcher publishes each aggregated entry; once enough new distracting time has
+    accumulated, the waiting detection thread wakes up, subject to debouncing and a
+    minimum interval between runs.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.pending_distraction = 0.0
+        self.last_publish = float('-inf')
+        self.last_run = float('-inf')
+        self.stats = {'published': 0, 'runs': 0}
+
+    def publish(self, aggregated_data_entry):
+        """
+        Record a new aggregate. Called from the log watcher thread.
+        """
+        distraction = sum(distracting_site_durations(aggregated_data_entry['data']).values())
+        with self.condition:
+            self.pending_distraction += distraction
+            self.last_publish = time.monotonic()
+            self.stats['published'] += 1
+            self.condition.notify_all()
+
+    def wait_for_trigger(self):
+        """
+        Block until new data crosses TRIGGER_DISTRACTION_SECONDS and the debounce and
+        minimum-interval delays have passed, then reset the accumulated data.
+        """
+        with self.condition:
+            while True:
+                if self.pending_distraction < TRIGGER_DISTRACTION_SECONDS:
+                    self.condition.wait()
+                    continue
+
+                ready_at = max(self.last_publish + DEBOUNCE_SECONDS, self.last_run + MIN_INTERVAL_SECONDS)
+                now = time.monotonic()
+                if now < ready_at:
+                    self.condition.wait(timeout=ready_at - now)
+                    continue
+
+                logging.info(
+                    f"Detection triggered by {self.pending_distraction:.0f}s of new distracting activity "
+                    f"({self.stats['runs'] + 1} runs for {self.stats['published']} aggregates)."
+                )
+                self.pending_distraction = 0.0
+                self.last_run = now
+                self.stats['runs'] += 1
+                return
+
+    def run(self, handler):
+        """
+        Loop forever, calling handler() each time detection is triggered.
+        """
+        while True:
+            self.wait_for_trigger()
+            handler()
+
+detection_scheduler = DetectionScheduler()
@@ -0,0 +1,154 @@
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from metrics import LatencyStats
+
+# Priorities, most urgent first.
+CHAT = 0
+SUMMARY = 1
+DETECTION = 2
+PRIORITY_NAMES = {CHAT: 'chat', SUMMARY: 'summary', DETECTION: 'detection'}
+
+# llama.cpp already spreads one generation over every core, so concurrent generations only
+# split the CPU between them. Allow one per 8 cores (env override for bigger machines or GPUs).
+MAX_CONCURRENT_INFERENCES = int(os.environ.get('MAX_CONCURRENT_INFERENCES', max(1, (os.cpu_count() or 1) // 8)))
+# Admission control: requests beyond this many already waiting at the same priority are rejected.
+MAX_QUEUED = {CHAT: 8, SUMMARY: 16, DETECTION: 1}
+
+class InferenceNotRun(RuntimeError):
+    """
+    The scheduler did not run the request; no model call was made.
+    """
+
+class InferenceRejected(InferenceNotRun):
+    """
+    Admission control turned the request away because its priority's queue is full.
+    """
+
+class InferenceCancelled(InferenceNotRun):
+    """
+    A queued low-priority request was cancelled in favour of more urgent work.
+    """
+
+class Ticket:
+    __slots__ = ('priority', 'sequence', 'enqueued_at', 'cancelled')
+
+    def __init__(self, priority, sequence):
+        self.priority = priority
+        self.sequence = sequence
+        self.enqueued_at = time.monotonic()
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+class InferenceScheduler:
+    """
+    Admits model calls from chat, summaries and detection in priority order, at most
+    max_concurrent at a time. When chat or summary work arrives, queued detection requests
+    are cancelled; detection is re-triggered by new activity anyway.
+    A running request is never interrupted.
+    """
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT_INFERENCES, max_queued=MAX_QUEUED):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.condition = threading.Condition()
+        self.waiting = []  # heap of Tickets
+        self.running = 0
+        self.sequence = itertools.count()
+        self.metrics = defaultdict(lambda: {'rejected': 0, 'cancelled': 0, 'max_queue_depth': 0})
+        # Queue wait per priority name; its count is the number of admitted requests.
+        self.wait_latency = LatencyStats()
+
+    def queue_depth(self, priority):
+        return sum(1 for ticket in self.waiting if ticket.priority == priority)
+
+    def _cancel_queued_detection(self):
+        for ticket in self.waiting:
+            if ticket.priority == DETECTION and not ticket.cancelled:
+                ticket.cancelled = True
+                self.condition.notify_all()
+
+    def acquire(self, priority):
+        """
+        Block until a slot is free and no more urgent request is waiting.
+        Raises InferenceRejected or InferenceCancelled instead of running.
+        """
+        name = PRIORITY_NAMES[priority]
+        with self.condition:
+            metrics = self.metrics[name]
+            if self.queue_depth(priority) >= self.max_queued[priority]:
+                metrics['rejected'] += 1
+                raise InferenceRejected(f"Too many queued {name} inference requests.")
+
+            if priority < DETECTION:
+                self._cancel_queued_detection()
+            ticket = Ticket(priority, next(self.sequence))
+            heapq.heappush(self.waiting, ticket)
+            metrics['max_queue_depth'] = max(metrics['max_queue_depth'], self.queue_depth(priority))
+
+            while not ticket.cancelled and not (self.running < self.max_concurrent and self.waiting[0] is ticket):
+                self.condition.wait()
+
+            if ticket.cancelled:
+                self.waiting.remove(ticket)
+                heapq.heapify(self.waiting)
+                self.condition.notify_all()
+                metrics['cancelled'] += 1
+                raise InferenceCancelled(f"Queued {name} inference cancelled for more urgent work.")
+
+            heapq.heappop(self.waiting)
+            self.running += 1
+            wait_ms = (time.monotonic() - ticket.enqueued_at) * 1000
+            self.wait_latency.record(name, wait_ms)
+            # The next ticket in line may also fit if more than one slot is free.
+            self.condition.notify_all()
+        if wait_ms > 1000:
+            logging.info(f"{name} inference waited {wait_ms:.0f} ms for a slot.")
+
+    def release(self):
+        with self.condition:
+            self.running -= 1
+            self.condition.notify_all()
+
+    @contextmanager
+    def slot(self, priority):
+        """
+        Hold an inference slot for the duration of the block, e.g. while a reply is streamed.
+        """
+        self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def run(self, priority, function, *args, **kwargs):
+        with self.slot(priority):
+            return function(*args, **kwargs)
+
+    def stats(self):
+        """
+        Returns per-priority admission counters, queue waits (wait.count is the number admitted)
+        and current queue depths.
+        """
+        with self.condition:
+            stats = {
+                'running': self.running,
+                'max_concurrent': self.max_concurrent,
+                'priorities': {name: dict(self.metrics[name]) for name in PRIORITY_NAMES.values()}
+            }
+            for priority, name in PRIORITY_NAMES.items():
+                stats['priorities'][name]['queue_depth'] = self.queue_depth(priority)
+        waits = self.wait_latency.snapshot()
+        for name, metrics in stats['priorities'].items():
+            metrics['wait'] = waits.get(name, {})
+        return stats
+
+inference_scheduler = InferenceScheduler()
@@ -0,0 +1,80 @@
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+STOPWORDS = frozenset("""
+a an and are as at be but by do does for from has have he her his i if in is it its me my no not of on
+or our she so than that the their them they this to was we were what when which who will with you your
+""".split())
+
+def tokenize(text):
+    """
+    Lowercase word tokens with common stopwords removed.
+    """
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+def term_frequencies(text):
+    return Counter(tokenize(text))
+
+class KnowledgeIndex:
+    """
+    In-memory BM25 inverted index over knowledge entries, updated one entry at a time.
+    Scoring a query only touches the postings of its own terms, so cost grows with
+    matches rather than with the size of the knowledge base.
+    """
+
+    def __init__(self):
+        self.postings = defaultdict(dict)  # term -> {entry id: term frequency}
+        self.doc_terms = {}  # entry id -> terms it contains, for removal
+        self.doc_lengths = {}
+        self.total_length = 0
+        self.lock = threading.Lock()
+
+    def add(self, entry_id, frequencies):
+        with self.lock:
+            if entry_id in self.doc_lengths:
+                self._remove(entry_id)
+            for term, tf in frequencies.items():
+                self.postings[term][entry_id] = tf
+            self.doc_terms[entry_id] = list(frequencies)
+            length = sum(frequencies.values())
+            self.doc_lengths[entry_id] = length
+            self.total_length += length
+
+    def remove(self, entry_id):
+        with self.lock:
+            self._remove(entry_id)
+
+    def _remove(self, entry_id):
+        if entry_id not in self.doc_lengths:
+            return
+        for term in self.doc_terms.pop(entry_id):
+            del self.postings[term][entry_id]
+            if not self.postings[term]:
+                del self.postings[term]
+        self.total_length -= self.doc_lengths.pop(entry_id)
+
+    def search(self, query, k):
+        """
+        Returns up to k (entry id, score) pairs for query, best first. Entries sharing no terms are omitted.
+        """
+        with self.lock:
+            n_docs = len(self.doc_lengths)
+            if not n_docs:
+                return []
+            avg_length = self.total_length / n_docs or 1.0
+            scores = defaultdict(float)
+            for term in set(tokenize(query)):
+                docs = self.postings.get(term)
+                if not docs:
+                    continue
+                idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                for entry_id, tf in docs.items():
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[entry_id] / avg_length)
+                    scores[entry_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
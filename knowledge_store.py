@@ -0,0 +1,127 @@
+import sqlite3
+import threading
+from collections import Counter, defaultdict
+
+from knowledge_index import KnowledgeIndex, term_frequencies
+
+DB_PATH = 'knowledge_base.db'
+
+class KnowledgeStore:
+    """
+    Knowledge base repository over one long-lived SQLite connection.
+    All entries and the count are cached in memory; every write invalidates the cache.
+    A BM25 index over the entries is persisted in the knowledge_terms table and kept
+    in step with every insert and delete.
+    """
+
+    def __init__(self, db_path=DB_PATH):
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.RLock()
+        self._entries = None  # cached list of (id, content), None when stale
+        self.index = KnowledgeIndex()
+
+        with self.lock:
+            self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS knowledge (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                content TEXT NOT NULL,
+                category TEXT
+            );
+            CREATE TABLE IF NOT EXISTS knowledge_terms (
+                knowledge_id INTEGER NOT NULL,
+                term TEXT NOT NULL,
+                tf INTEGER NOT NULL,
+                PRIMARY KEY (knowledge_id, term)
+            );
+            ''')
+            self.conn.commit()
+            self._load_index()
+
+    def _load_index(self):
+        """
+        Load the persisted term frequencies into the in-memory index, indexing any
+        entries that predate the knowledge_terms table.
+        """
+        frequencies = defaultdict(Counter)
+        for knowledge_id, term, tf in self.conn.execute('SELECT knowledge_id, term, tf FROM knowledge_terms'):
+            frequencies[knowledge_id][term] = tf
+
+        with self.conn:
+            for knowledge_id, content in self._cached_entries():
+                if knowledge_id not in frequencies:
+                    frequencies[knowledge_id] = term_frequencies(content)
+                    self._persist_terms(knowledge_id, frequencies[knowledge_id])
+                self.index.add(knowledge_id, frequencies[knowledge_id])
+
+    def _persist_terms(self, knowledge_id, frequencies):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO knowledge_terms (knowledge_id, term, tf) VALUES (?, ?, ?)",
+            [(knowledge_id, term, tf) for term, tf in frequencies.items()]
+        )
+
+    def invalidate(self):
+        with self.lock:
+            self._entries = None
+
+    def _cached_entries(self):
+        with self.lock:
+            if self._entries is None:
+                self._entries = self.conn.execute('SELECT id, content FROM knowledge ORDER BY id').fetchall()
+            return self._entries
+
+    def entries(self):
+        """
+        Returns all entries as a list of (id, content) tuples, served from cache when fresh.
+        """
+        return list(self._cached_entries())
+
+    def count(self):
+        return len(self._cached_entries())
+
+    def replace(self, delete_ids, contents):
+        """
+        Deletes the entries in delete_ids and inserts contents in a single transaction,
+        together with their index terms. Category column is unused, so new rows store 'N/A'.
+        """
+        delete_ids = [int(knowledge_id) for knowledge_id in delete_ids]
+        inserted = []
+        with self.lock:
+            with self.conn:
+                self.conn.executemany("DELETE FROM knowledge WHERE id = ?", [(i,) for i in delete_ids])
+                self.conn.executemany("DELETE FROM knowledge_terms WHERE knowledge_id = ?", [(i,) for i in delete_ids])
+                for content in contents:
+                    cursor = self.conn.execute(
+                        "INSERT INTO knowledge (content, category) VALUES (?, ?)",
+                        (content, "N/A")
+                    )
+                    frequencies = term_frequencies(content)
+                    self._persist_terms(cursor.lastrowid, frequencies)
+                    inserted.append((cursor.lastrowid, frequencies))
+            self.invalidate()
+
+            for knowledge_id in delete_ids:
+                self.index.remove(knowledge_id)
+            for knowledge_id, frequencies in inserted:
+                self.index.add(knowledge_id, frequencies)
+
+    def insert_many(self, contents):
+        self.replace([], contents)
+
+    def delete_many(self, knowledge_ids):
+        self.replace(knowledge_ids, [])
+
+    def search(self, query, k):
+        """
+        Returns the contents of the k entries most relevant to query, best first.
+        Falls back to the k most recent entries when nothing matches.
+        """
+        with self.lock:
+            contents = dict(self._cached_entries())
+            ranked = [contents[knowledge_id] for knowledge_id, _ in self.index.search(query, k) if knowledge_id in contents]
+            if not ranked:
+                ranked = [content for _, content in self._cached_entries()[-k:]][::-1]
+            return ranked
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
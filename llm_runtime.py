@@ -0,0 +1,307 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import socket
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+LLAMA_SERVER_PATH = os.environ.get('LLAMA_SERVER_PATH', "/Users/seanzhang/llama.cpp/build/bin/llama-server")
+SERVER_HOST = "127.0.0.1"
+SLOT_SAVE_DIR = os.path.abspath('llm_slots')
+STARTUP_TIMEOUT = 180
+REQUEST_TIMEOUT = 600
+
+def prefix_cache_name(label, model_path, prefix):
+    """
+    Stable file name for a saved prompt prefix; changes whenever the model or the prefix text changes.
+    """
+    digest = hashlib.sha1(f"{model_path}\0{prefix}".encode('utf-8')).hexdigest()[:16]
+    return f"{label}-{digest}.bin"
+
+def find_free_port():
+    """
+    Ask the OS for an unused local TCP port.
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((SERVER_HOST, 0))
+        return sock.getsockname()[1]
+
+class LLMRuntime:
+    """
+    A resident llama.cpp server process that keeps one model loaded.
+    Prompts are sent over a local HTTP socket instead of reloading the GGUF file on every call.
+    """
+
+    def __init__(self, model_path, n_ctx, n_gpu_layers=1, server_path=None):
+        self.model_path = model_path
+        self.n_ctx = n_ctx
+        self.n_gpu_layers = n_gpu_layers
+        self.server_path = server_path or LLAMA_SERVER_PATH
+        self.port = None
+        self.process = None
+        self.session = requests.Session()
+        self.lock = threading.Lock()
+        # Signalled when a request finishes or a restart completes; shares self.lock.
+        self.condition = threading.Condition(self.lock)
+        self.in_flight = 0
+        self.restarting = False
+        # Prompt prefixes whose KV state is known to be in the slot since the last (re)start.
+        self.warm_prefixes = set()
+        # Bumped by every (re)start, which empties the slot.
+        self.starts = 0
+        # Serializes warm_prefix so concurrent callers prefill and save a prefix only once.
+        self.warm_lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"http://{SERVER_HOST}:{self.port}"
+
+    def is_running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def server_command(self):
+        """
+        Command line used to launch the server process.
+        """
+        return [
+            self.server_path,
+            "-m", self.model_path,
+            "-c", str(self.n_ctx),
+            "-ngl", str(self.n_gpu_layers),
+            "-np", "1",
+            "--host", SERVER_HOST,
+            "--port", str(self.port),
+            "--slot-save-path", SLOT_SAVE_DIR
+        ]
+
+    def _start(self):
+        """
+        Launch the server and block until the model reports healthy. Caller holds self.lock.
+        """
+        self.port = find_free_port()
+        self.warm_prefixes = set()
+        self.starts += 1
+        os.makedirs(SLOT_SAVE_DIR, exist_ok=True)
+        logging.info(f"Loading model {self.model_path} (ctx={self.n_ctx}) into resident LLM server on port {self.port}.")
+        started = time.monotonic()
+        self.process = subprocess.Popen(
+            self.server_command(),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+
+        while time.monotonic() - started < STARTUP_TIMEOUT:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"LLM server for {self.model_path} exited during startup (code {self.process.returncode}).")
+            try:
+                response = self.session.get(f"{self.base_url}/health", timeout=2)
+                if response.status_code == 200:
+                    logging.info(f"Model {self.model_path} loaded in {time.monotonic() - started:.1f}s.")
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.25)
+
+        self._stop()
+        raise RuntimeError(f"LLM server for {self.model_path} did not become ready within {STARTUP_TIMEOUT}s.")
+
+    def _stop(self):
+        """
+        Terminate the server process if it is running. Caller holds self.lock.
+        """
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.process = None
+
+    def _ensure_started(self):
+        """
+        Start the server if it is not up. Caller holds self.lock.
+        """
+        if not self.is_running():
+            if self.process is not None:
+                logging.warning(f"LLM server for {self.model_path} exited (code {self.process.returncode}); restarting.")
+            self._start()
+
+    def ensure_running(self, n_ctx=None):
+        """
+        Start the server if it is not up. If a caller needs a larger context, restarts it once
+        after the requests in flight have finished; new requests wait for the restart.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: not self.restarting)
+            if n_ctx is not None and n_ctx > self.n_ctx:
+                logging.info(f"Growing context for {self.model_path} from {self.n_ctx} to {n_ctx}; restarting LLM server.")
+                self.restarting = True
+                try:
+                    self.condition.wait_for(lambda: self.in_flight == 0)
+                    self.n_ctx = n_ctx
+                    self._stop()
+                    self._start()
+                finally:
+                    self.restarting = False
+                    self.condition.notify_all()
+            self._ensure_started()
+
+    @contextmanager
+    def serving(self):
+        """
+        Count a request as in flight for the duration of the block, so a restart waits for it.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: not self.restarting)
+            self._ensure_started()
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.in_flight -= 1
+                self.condition.notify_all()
+
+    def request(self, prompt, n_predict=-1, **options):
+        """
+        Run a single completion and return the server's full JSON response.
+        """
+        payload = {"prompt": prompt, "n_predict": n_predict}
+        payload.update(options)
+        with self.serving():
+            response = self.session.post(f"{self.base_url}/completion", json=payload, timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+            return response.json()
+
+    def complete(self, prompt, n_predict=-1, **options):
+        """
+        Run a single completion and return only the generated text.
+        """
+        return self.request(prompt, n_predict=n_predict, **options).get("content", "")
+
+    def stream(self, prompt, n_predict=-1, **options):
+        """
+        Run a single completion, yielding text pieces as the server produces them.
+        """
+        payload = {"prompt": prompt, "n_predict": n_predict, "stream": True}
+        payload.update(options)
+        with self.serving(), self.session.post(f"{self.base_url}/completion", json=payload, stream=True, timeout=REQUEST_TIMEOUT) as response:
+            response.raise_for_status()
+            # llama-server sends text/event-stream without a charset; the body is always UTF-8.
+            for raw_line in response.iter_lines():
+                line = raw_line.decode('utf-8')
+                if not line or not line.startswith("data: "):
+                    continue
+                chunk = json.loads(line[len("data: "):])
+                if chunk.get("content"):
+                    yield chunk["content"]
+                if chunk.get("stop"):
+                    break
+
+    def slot_action(self, action, filename, slot_id=0):
+        """
+        Save or restore a slot's evaluated KV state to/from a file under SLOT_SAVE_DIR.
+        """
+        with self.serving():
+            response = self.session.post(
+                f"{self.base_url}/slots/{slot_id}",
+                params={"action": action},
+                json={"filename": filename},
+                timeout=REQUEST_TIMEOUT
+            )
+            response.raise_for_status()
+            return response.json()
+
+    def warm_prefix(self, prefix, cache_name):
+        """
+        Make sure the KV state for a static prompt prefix is resident in the slot.
+        Restores it from a saved slot file if one exists, otherwise prefills it once and saves it.
+        Later completions sent with cache_prompt=True then only prefill the text after the prefix.
+        A prefix is only marked warm if the server was not restarted while it was being loaded.
+        """
+        with self.warm_lock:
+            self.ensure_running()
+            with self.lock:
+                if cache_name in self.warm_prefixes:
+                    return
+                starts = self.starts
+            try:
+                self.slot_action("restore", cache_name)
+                logging.info(f"Restored cached prompt prefix {cache_name}.")
+            except requests.RequestException:
+                started = time.monotonic()
+                self.request(prefix, n_predict=0, cache_prompt=True)
+                logging.info(f"Prefilled prompt prefix {cache_name} in {time.monotonic() - started:.2f}s.")
+                try:
+                    self.slot_action("save", cache_name)
+                except requests.RequestException as e:
+                    logging.warning(f"Could not save prompt prefix {cache_name}: {e}")
+            with self.lock:
+                if self.starts == starts:
+                    self.warm_prefixes.add(cache_name)
+                else:
+                    logging.info(f"LLM server restarted while loading prompt prefix {cache_name}; not marking it warm.")
+
+    def stop(self):
+        with self.lock:
+            self._stop()
+
+# One resident runtime per model file, shared by every caller in the process.
+runtimes = {}
+runtimes_lock = threading.Lock()
+# Largest context any caller has reserved per model file; the server is started with it.
+context_sizes = {}
+
+def reserve_context(model_path, n_ctx):
+    """
+    Declare up front that a caller uses model_path with up to n_ctx tokens, so callers that
+    share a model file (e.g. chat and summaries) start it once at the largest size instead of
+    restarting it mid-conversation. Call at import time, before the first request.
+    """
+    with runtimes_lock:
+        context_sizes[model_path] = max(n_ctx, context_sizes.get(model_path, 0))
+
+def get_runtime(model_path, n_ctx):
+    """
+    Return the resident runtime for model_path, loading the model on first use.
+    """
+    with runtimes_lock:
+        n_ctx = max(n_ctx, context_sizes.get(model_path, 0))
+        runtime = runtimes.get(model_path)
+        if runtime is None:
+            runtime = LLMRuntime(model_path, n_ctx)
+            runtimes[model_path] = runtime
+    runtime.ensure_running(n_ctx)
+    return runtime
+
+def complete(model_path, prompt, n_ctx, n_predict=-1, **options):
+    """
+    Convenience wrapper: generate text for prompt with the resident model at model_path.
+    """
+    return get_runtime(model_path, n_ctx).complete(prompt, n_predict=n_predict, **options)
+
+def stream(model_path, prompt, n_ctx, n_predict=-1, **options):
+    """
+    Convenience wrapper: stream generated text for prompt from the resident model at model_path.
+    """
+    yield from get_runtime(model_path, n_ctx).stream(prompt, n_predict=n_predict, **options)
+
+def shutdown_all():
+    """
+    Stop every resident LLM server. Registered to run at interpreter exit.
+    """
+    with runtimes_lock:
+        for runtime in runtimes.values():
+            runtime.stop()
+        runtimes.clear()
+
+atexit.register(shutdown_all)
@@ -1,115 +1,450 @@
 import requests
 import time
-import sqlite3
 import threading
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from collections import defaultdict
+from collections import defaultdict, deque
+from operator import attrgetter
+from types import MappingProxyType
+from requests.adapters import HTTPAdapter
+
+from activity_events import events_from_json, not_afk_intervals, sum_by_title, TitleTable
+from activity_store import activity_store
+from metrics import LatencyStats
+from title_normalizer import normalize_title
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s:%(message)s')
 
-ACTIVITYWATCH_SERVER = 'http://localhost:5600'
+ACTIVITYWATCH_SERVER = os.environ.get('ACTIVITYWATCH_SERVER', 'http://localhost:5600')
 WINDOW_BUCKET = 'aw-watcher-window_MacBookAir.fios-router.home'
 AFK_BUCKET = 'aw-watcher-afk_MacBookAir.fios-router.home'
 
+# 'raw' pulls both buckets and filters/aggregates locally; 'query' lets ActivityWatch do it via /api/0/query.
+FETCH_MODE = 'raw'
+
+# Group aggregates by canonical app/site category instead of raw window title.
+NORMALIZE_TITLES = True
+
 FETCH_INTERVAL = 30
 TIME_WINDOW = 60 * 5
 CONTEXT_WINDOW = 60 * 15
 
-conn = sqlite3.connect('activity_logs.db', check_same_thread=False)
-cursor = conn.cursor()
+# Gaps longer than this (e.g. after sleep) are fetched as consecutive sub-windows of this size,
+# each recorded as its own aggregate.
+BACKFILL_CHUNK_SECONDS = TIME_WINDOW
+# Events per request when paging through a bucket.
+EVENT_PAGE_SIZE = 500
 
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS aggregated_logs (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    start_time DATETIME NOT NULL,
-    end_time DATETIME NOT NULL,
-    data TEXT NOT NULL
-)
-''')
-conn.commit()
+HTTP_TIMEOUT = 10
+FETCH_RETRIES = 3
+FETCH_BACKOFF = 1  # seconds before the first retry, doubled after each failed attempt
 
-logging.info("Resetting aggregated_logs table on startup.")
-cursor.execute('DELETE FROM aggregated_logs')
-conn.commit()
+class RunningContext:
+    """
+    Sliding window of aggregated entries split into 'recent' (ended within the last
+    TIME_WINDOW) and 'context' (the CONTEXT_WINDOW before that), each with a running
+    per-title sum. Entries are added to a sum on arrival, move from recent to context
+    as they age, and are subtracted on eviction, so neither side is ever rebuilt.
+    """
 
-running_context = []
-running_context_lock = threading.Lock()
+    def __init__(self, recent_seconds, context_seconds):
+        self.recent_seconds = recent_seconds
+        self.context_seconds = context_seconds
+        self.recent = deque()  # (end_time as epoch seconds, entry), oldest first
+        self.context = deque()
+        self.recent_totals = defaultdict(float)
+        self.context_totals = defaultdict(float)
+        self.lock = threading.Lock()
+        self._snapshot = (None, MappingProxyType({}))
+
+    @staticmethod
+    def _accumulate(totals, data, sign):
+        for title, duration in data.items():
+            if not title.strip():
+                continue
+            totals[title] += sign * duration
+            if sign < 0 and totals[title] <= 1e-6:
+                del totals[title]
+
+    def _refresh_snapshot(self):
+        """
+        Rebuild the read-only (recent entry, condensed context) pair.
+        """
+        if not self.recent:
+            self._snapshot = (None, MappingProxyType(dict(self.context_totals)))
+            return
+        recent_entry = {
+            'start_time': self.recent[0][1]['start_time'],
+            'end_time': self.recent[-1][1]['end_time'],
+            'data': dict(self.recent_totals)
+        }
+        self._snapshot = (recent_entry, MappingProxyType(dict(self.context_totals)))
+
+    def append(self, entry, now=None):
+        """
+        Add a new aggregated entry, age older entries from recent into context,
+        and evict entries that ended before the context window.
+        """
+        now = (now or datetime.now(timezone.utc)).timestamp()
+        recent_cutoff = now - self.recent_seconds
+        context_cutoff = recent_cutoff - self.context_seconds
+
+        with self.lock:
+            self.recent.append((datetime.fromisoformat(entry['end_time']).timestamp(), entry))
+            self._accumulate(self.recent_totals, entry['data'], 1)
+
+            while self.recent and self.recent[0][0] < recent_cutoff:
+                aged = self.recent.popleft()
+                self._accumulate(self.recent_totals, aged[1]['data'], -1)
+                self.context.append(aged)
+                self._accumulate(self.context_totals, aged[1]['data'], 1)
+
+            while self.context and self.context[0][0] < context_cutoff:
+                _, evicted = self.context.popleft()
+                self._accumulate(self.context_totals, evicted['data'], -1)
+
+            self._refresh_snapshot()
+
+    def snapshot(self):
+        """
+        Returns a consistent (recent entry, condensed context) pair without copying the window.
+        The recent entry sums every entry that ended within the last TIME_WINDOW and is None
+        when there are none.
+        """
+        return self._snapshot
+
+    def __len__(self):
+        return len(self.recent) + len(self.context)
+
+running_context = RunningContext(TIME_WINDOW, CONTEXT_WINDOW)
+
+# Callbacks invoked with every new aggregated_data_entry, e.g. the detection scheduler.
+aggregate_listeners = []
+
+# Filled in by warm_start(): how much context was recovered at boot and how long it took.
+warm_start_stats = {}
+# Totals over every backfill() run.
+backfill_stats = {'runs': 0, 'chunks': 0, 'seconds': 0.0, 'elapsed_ms': 0.0}
+
+# Keep-alive connections to ActivityWatch, shared by every fetch.
+http_session = requests.Session()
+http_session.headers.update({'Cache-Control': 'no-cache'})
+http_session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+fetch_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='BucketFetch')
+
+# Per-label fetch latency and failures.
+fetch_latency = LatencyStats()
+
+def get_watcher_stats():
+    """
+    Returns fetch latency per label plus the warm start and backfill counters.
+    """
+    return {'fetch_latency': fetch_latency.snapshot(), 'warm_start': dict(warm_start_stats), 'backfill': dict(backfill_stats)}
 
-def fetch_events(bucket_id, start_iso, end_iso):
+def request_json(method, url, label, **kwargs):
     """
-    Fetch events from the specified ActivityWatch bucket within the given time range.
+    Issue a request over the pooled session and return its JSON body.
+    Retries with exponential backoff on connection errors, timeouts and HTTP error statuses;
+    returns None once FETCH_RETRIES attempts have failed.
     """
-    url = f"{ACTIVITYWATCH_SERVER}/api/0/buckets/{bucket_id}/events"
-    params = {"start": start_iso, "end": end_iso}
-    headers = {'Cache-Control': 'no-cache'}
+    for attempt in range(1, FETCH_RETRIES + 1):
+        started = time.perf_counter()
+        try:
+            response = http_session.request(method, url, timeout=HTTP_TIMEOUT, **kwargs)
+            response.raise_for_status()
+            body = response.json()
+        except requests.RequestException as e:
+            fetch_latency.record_failure(label)
+            logging.warning(f"Fetch of {label} failed (attempt {attempt}/{FETCH_RETRIES}): {e}")
+            if attempt < FETCH_RETRIES:
+                time.sleep(FETCH_BACKOFF * 2 ** (attempt - 1))
+            continue
 
-    response = requests.get(url, params=params, headers=headers, timeout=10)
-    response.raise_for_status()
+        latency_ms = (time.perf_counter() - started) * 1000
+        fetch_latency.record(label, latency_ms)
+        logging.debug(f"Fetched {label} in {latency_ms:.1f} ms.")
+        return body
 
-    return response.json()
+    logging.error(f"Giving up on {label} after {FETCH_RETRIES} attempts.")
+    return None
 
-def filter_non_afk_events(window_events, afk_events):
+def fetch_events(bucket_id, start_iso, end_iso):
     """
-    Filter window events to include only those during non-AFK periods.
+    Fetch events from the specified ActivityWatch bucket within the given time range,
+    paging backwards from end_iso EVENT_PAGE_SIZE events per request.
+    Returns None if the bucket could not be fetched.
     """
-    not_afk_periods = [event for event in afk_events if event['data'].get('status') == 'not-afk']
-    filtered_events = []
+    url = f"{ACTIVITYWATCH_SERVER}/api/0/buckets/{bucket_id}/events"
+    events = []
+    seen = set()
+    page_end = end_iso
+    pages = 0
+    started = time.perf_counter()
 
-    for event in window_events:
-        event_start = datetime.fromisoformat(event['timestamp'])
-        event_end = event_start + timedelta(seconds=event['duration'])
+    while True:
+        params = {"start": start_iso, "end": page_end, "limit": EVENT_PAGE_SIZE}
+        page = request_json('GET', url, bucket_id, params=params)
+        if page is None:
+            return None
+        pages += 1
+
+        # Pages are newest first and the next page ends at this page's oldest event, which it repeats.
+        new_events = [event for event in page if (event.get('id'), event['timestamp']) not in seen]
+        seen.update((event.get('id'), event['timestamp']) for event in new_events)
+        events.extend(new_events)
+        if len(page) < EVENT_PAGE_SIZE or not new_events:
+            break
+        page_end = page[-1]['timestamp']
+
+    logging.info(
+        f"Fetched {len(events)} events from {bucket_id} in {pages} page(s) in {(time.perf_counter() - started) * 1000:.1f} ms."
+    )
+    return events
+
+def fetch_bucket_events(start_iso, end_iso):
+    """
+    Fetch the window and AFK buckets concurrently. Returns (window_events, afk_events).
+    """
+    window_future = fetch_executor.submit(fetch_events, WINDOW_BUCKET, start_iso, end_iso)
+    afk_future = fetch_executor.submit(fetch_events, AFK_BUCKET, start_iso, end_iso)
+    return window_future.result(), afk_future.result()
 
-        for period in not_afk_periods:
-            period_start = datetime.fromisoformat(period['timestamp'])
-            period_end = period_start + timedelta(seconds=period['duration'])
+def build_aggregation_query(window_bucket, afk_bucket):
+    """
+    ActivityWatch query that intersects window events with not-afk time.
+    Events are returned unmerged so they can still be clipped to the fetch window.
+    """
+    return [
+        f'window_events = flood(query_bucket("{window_bucket}"));',
+        f'afk_events = flood(query_bucket("{afk_bucket}"));',
+        'not_afk = filter_keyvals(afk_events, "status", ["not-afk"]);',
+        'RETURN = filter_period_intersect(window_events, not_afk);'
+    ]
+
+def fetch_aggregated_via_query(start_time, end_time):
+    """
+    Fetch per-title non-AFK durations in one /api/0/query request, with the AFK intersection
+    done server-side. Events straddling the window edges are clipped to [start_time, end_time]
+    before summing, as in the raw path. Returns the same dict shape as aggregate_durations,
+    or None if the query failed.
+    """
+    start_iso = start_time.isoformat()
+    end_iso = end_time.isoformat()
+    url = f"{ACTIVITYWATCH_SERVER}/api/0/query/"
+    payload = {
+        "timeperiods": [f"{start_iso}/{end_iso}"],
+        "query": build_aggregation_query(WINDOW_BUCKET, AFK_BUCKET)
+    }
+
+    started = time.perf_counter()
+    result = request_json('POST', url, 'query', json=payload)
+    if result is None:
+        return None
+    logging.info(f"Fetched {len(result[0])} non-AFK events via query in {(time.perf_counter() - started) * 1000:.1f} ms.")
+
+    # One result list per timeperiod; the window itself is the only period events are clipped to.
+    title_table = new_title_table()
+    bounds = (start_time.timestamp(), end_time.timestamp())
+    events = filter_non_afk_events(events_from_json(result[0], title_table), [bounds])
+    return sum_by_title(events, title_table)
+
+def merge_intervals(intervals):
+    """
+    Sort (start, end) intervals and merge any that overlap or touch.
+    """
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+def filter_non_afk_events(window_events, not_afk_periods, bounds=None):
+    """
+    Filter window Events to include only those during non-AFK periods ((start, end) epoch seconds).
+    Each kept event's duration is clipped, in place, to the time it actually overlaps non-AFK periods,
+    and to bounds ((start, end) epoch seconds) if given, so events straddling the edge of a
+    fetch window are not counted again by the next window.
+    Sweeps sorted events over sorted, merged periods.
+    """
+    not_afk_periods = merge_intervals(not_afk_periods)
+    if bounds is not None:
+        low, high = bounds
+        not_afk_periods = [
+            [max(start, low), min(end, high)] for start, end in not_afk_periods if start < high and end > low
+        ]
 
-            if event_start < period_end and event_end > period_start:
-                filtered_events.append(event)
-                break
+    filtered_events = []
+    first_period = 0
+    for event in sorted(window_events, key=attrgetter('start')):
+        event_start, event_end = event.start, event.end
+        # Event starts only move forward, so periods ending before this one can be skipped for good.
+        while first_period < len(not_afk_periods) and not_afk_periods[first_period][1] <= event_start:
+            first_period += 1
+
+        overlap = 0.0
+        index = first_period
+        while index < len(not_afk_periods) and not_afk_periods[index][0] < event_end:
+            period_start, period_end = not_afk_periods[index]
+            overlap += min(event_end, period_end) - max(event_start, period_start)
+            index += 1
+
+        if overlap > 0:
+            event.duration = overlap
+            filtered_events.append(event)
 
     return filtered_events
 
-def aggregate_durations(events):
+def new_title_table():
+    return TitleTable(normalize_title if NORMALIZE_TITLES else None)
+
+def aggregate_durations(raw_events):
     """
-    Aggregate time spent on each activity.
+    Aggregate time spent on each activity in ActivityWatch events, keyed by normalized title
+    when NORMALIZE_TITLES is set.
     """
-    durations = defaultdict(float)
-    for event in events:
-        title = event.get('data', {}).get('title', 'Unknown')
-        duration = event.get('duration', 0)
-        durations[title] += duration
-    return dict(durations)
+    title_table = new_title_table()
+    return sum_by_title(events_from_json(raw_events, title_table), title_table)
 
 def maintain_running_context(aggregated_data):
     """
     Maintain running context -- no overlap with recent.
     """
-    with running_context_lock:
-        running_context.append(aggregated_data)
-        current_time = datetime.now(timezone.utc) - timedelta(seconds=TIME_WINDOW)
-        cutoff_time = current_time - timedelta(seconds=CONTEXT_WINDOW)
+    running_context.append(aggregated_data)
 
-        while running_context and datetime.fromisoformat(running_context[0]['end_time']) < cutoff_time:
-            running_context.pop(0)
+def add_aggregate_listener(callback):
+    """
+    Register callback(aggregated_data_entry) to be called after each new aggregate is recorded.
+    """
+    aggregate_listeners.append(callback)
 
 def store_aggregated_data(start_time, end_time, aggregated_data):
     """
     Store the aggregated data in the SQLite database.
     """
-    cursor.execute('''
-        INSERT INTO aggregated_logs (start_time, end_time, data)
-        VALUES (?, ?, ?)
-    ''', (start_time.isoformat(), end_time.isoformat(), str(aggregated_data)))
-    conn.commit()
+    activity_store.store(start_time, end_time, aggregated_data)
+
+
+def fetch_aggregated(start_time, end_time):
+    """
+    Fetch and aggregate non-AFK activity between start_time and end_time using FETCH_MODE.
+    Returns the per-title durations dict, or None if ActivityWatch could not be reached.
+    """
+    if FETCH_MODE == 'query':
+        return fetch_aggregated_via_query(start_time, end_time)
+
+    start_iso = start_time.isoformat()
+    end_iso = end_time.isoformat()
+
+    window_events, afk_events = fetch_bucket_events(start_iso, end_iso)
+    if window_events is None or afk_events is None:
+        return None
+
+    # Parse every timestamp and title once into compact Events; the JSON is dropped after this.
+    title_table = new_title_table()
+    events = events_from_json(window_events, title_table)
+    not_afk_periods = not_afk_intervals(afk_events)
+    del window_events, afk_events
+
+    filtered_events = filter_non_afk_events(events, not_afk_periods, (start_time.timestamp(), end_time.timestamp()))
+    return sum_by_title(filtered_events, title_table)
+
+def record_aggregate(start_time, end_time, aggregated_data, notify=True):
+    """
+    Add one aggregated window to the running context and the persistent store,
+    then pass it to the aggregate listeners if notify is set.
+    """
+    aggregated_data_entry = {
+        'start_time': start_time.isoformat(),
+        'end_time': end_time.isoformat(),
+        'data': aggregated_data
+    }
+
+    maintain_running_context(aggregated_data_entry)
+    store_aggregated_data(start_time, end_time, aggregated_data)
+    logging.info(f"Aggregated data from {start_time.isoformat()} to {end_time.isoformat()} stored.")
 
+    if notify:
+        for listener in aggregate_listeners:
+            listener(aggregated_data_entry)
+
+def backfill(start_time, end_time):
+    """
+    Fetch and record start_time..end_time as consecutive BACKFILL_CHUNK_SECONDS sub-windows.
+    Each chunk becomes its own aggregate, so memory per fetch stays bounded however long the
+    gap is and running_context ages the chunks by their real end times. Only chunks ending
+    within TIME_WINDOW of end_time reach the aggregate listeners, so detection never runs on
+    hours-old activity. Returns the time up to which the gap was filled.
+    """
+    started = time.perf_counter()
+    chunk = timedelta(seconds=BACKFILL_CHUNK_SECONDS)
+    chunk_start = start_time
+    chunks = 0
+
+    while chunk_start < end_time:
+        chunk_end = min(chunk_start + chunk, end_time)
+        aggregated_data = fetch_aggregated(chunk_start, chunk_end)
+        if aggregated_data is None:
+            logging.error(f"Backfill stopped at {chunk_start.isoformat()}; the fetch loop will retry the rest.")
+            break
+        recent = (end_time - chunk_end).total_seconds() < TIME_WINDOW
+        record_aggregate(chunk_start, chunk_end, aggregated_data, notify=recent)
+        chunk_start = chunk_end
+        chunks += 1
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    backfill_stats['runs'] += 1
+    backfill_stats['chunks'] += chunks
+    backfill_stats['seconds'] += (chunk_start - start_time).total_seconds()
+    backfill_stats['elapsed_ms'] += elapsed_ms
+    logging.info(
+        f"Backfilled {(chunk_start - start_time).total_seconds():.0f}s in {chunks} chunk(s) in {elapsed_ms:.1f} ms."
+    )
+    return chunk_start
+
+def warm_start():
+    """
+    Rebuild running_context from the last CONTEXT_WINDOW of persisted aggregates, then backfill
+    the gap since the newest stored entry in chunks. Returns the time the regular
+    fetch loop should continue from.
+    """
+    started = time.perf_counter()
+    now = datetime.now(timezone.utc)
+    horizon = now - timedelta(seconds=TIME_WINDOW + CONTEXT_WINDOW)
+
+    stored_entries = activity_store.entries_between(horizon, now)
+    for entry in stored_entries:
+        maintain_running_context(entry)
+
+    if stored_entries:
+        backfill_start = max(datetime.fromisoformat(stored_entries[-1]['end_time']), horizon)
+    else:
+        backfill_start = horizon
+
+    resume_time = backfill(backfill_start, now)
+
+    warm_start_stats.update({
+        'restored_entries': len(stored_entries),
+        'backfilled_seconds': (resume_time - backfill_start).total_seconds(),
+        'elapsed_ms': (time.perf_counter() - started) * 1000
+    })
+    logging.info(
+        f"Warm start: restored {len(stored_entries)} stored entries, backfilled "
+        f"{warm_start_stats['backfilled_seconds']:.0f}s in {warm_start_stats['elapsed_ms']:.1f} ms."
+    )
+    return resume_time
 
 def log_watcher():
     """
     Main function for processing logs.
     """
     logging.info("Starting ActivityWatch Log Watcher...")
-    last_fetched_time = datetime.now(timezone.utc) - timedelta(seconds=TIME_WINDOW)
+    activity_store.start_rollup_thread()
+    last_fetched_time = warm_start()
+    time.sleep(FETCH_INTERVAL)
 
     while True:
         end_time = datetime.now(timezone.utc)
@@ -117,29 +452,19 @@ def log_watcher():
 
         logging.info(f"Fetching events from {start_time.isoformat()} to {end_time.isoformat()}")
 
-        start_iso = start_time.isoformat()
-        end_iso = end_time.isoformat()
-
-        window_events = fetch_events(WINDOW_BUCKET, start_iso, end_iso)
-        afk_events = fetch_events(AFK_BUCKET, start_iso, end_iso)
+        # After sleep or a failed fetch the gap can be hours long; fetch it in bounded chunks.
+        if (end_time - start_time).total_seconds() > BACKFILL_CHUNK_SECONDS:
+            last_fetched_time = backfill(start_time, end_time)
+            time.sleep(FETCH_INTERVAL)
+            continue
 
-        if window_events is None or afk_events is None:
+        aggregated_data = fetch_aggregated(start_time, end_time)
+        if aggregated_data is None:
             logging.error("Failed to fetch events. Retrying...")
             time.sleep(FETCH_INTERVAL)
             continue
 
-        filtered_events = filter_non_afk_events(window_events, afk_events)
-
-        aggregated_data = aggregate_durations(filtered_events)
-        aggregated_data_entry = {
-            'start_time': start_time.isoformat(),
-            'end_time': end_time.isoformat(),
-            'data': aggregated_data
-        }
-
-        maintain_running_context(aggregated_data_entry)
-        store_aggregated_data(start_time, end_time, aggregated_data)
-        logging.info(f"Aggregated data from {start_time.isoformat()} to {end_time.isoformat()} stored.")
+        record_aggregate(start_time, end_time, aggregated_data)
         last_fetched_time = end_time
 
         time.sleep(FETCH_INTERVAL)
@@ -154,4 +479,4 @@ if __name__ == "__main__":
             time.sleep(1)
     except KeyboardInterrupt:
         logging.info("Shutting down Log Watcher.")
-        conn.close()
\ No newline at end of file
+        activity_store.close()
\ No newline at end of file
@@ -2,15 +2,16 @@ import threading
 import time
 import logging
 import os
-import subprocess
 import webbrowser
-import platform
 from datetime import datetime, timedelta, timezone
 
-from log_watcher import log_watcher, running_context, running_context_lock
+from log_watcher import log_watcher, running_context, add_aggregate_listener
+from detection_scheduler import detection_scheduler
 from detection_llm import detection_llm
-from app import socketio, app
+from app import socketio, app, summary_jobs
 from shared_state import is_conversation_active, set_conversation_active
+from notifications import NotificationDispatcher, default_backend
+from chat_prewarm import chat_prewarm
 
 # UTC formatting for logs
 class UTCFormatter(logging.Formatter):
@@ -45,93 +46,31 @@ notifications_suppressed = False
 notifications_suppressed_until = datetime.min.replace(tzinfo=timezone.utc)
 notifications_suppression_lock = threading.Lock()
 
-def trigger_desktop_notification_with_response(title, message, timeout=30):
+notification_dispatcher = NotificationDispatcher(default_backend(socketio))
+
+def accept_intervention():
     """
-    Sends a macOS notification with 'Accept'/'Deny' options. Returns the user's response.
+    Dispatcher callback: the user accepted the invitation to chat.
     """
-    script = f'''
-    set userChoice to button returned of (display dialog "{message}" with title "{title}" buttons {{"Deny", "Accept"}} default button "Accept")
-    return userChoice
-    '''
-    try:
-        logging.info("Sending desktop notification for user response.")
-        process = subprocess.Popen(['osascript', '-e', script],
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE)
-        stdout, stderr = process.communicate(timeout=timeout)
-        if process.returncode != 0:
-            logging.error(f"AppleScript Error: {stderr.decode('utf-8').strip()}")
-            return 'Deny'
-        user_choice = stdout.decode('utf-8').strip()
-        logging.info(f"User selected: {user_choice}")
-        return user_choice
-    except subprocess.TimeoutExpired:
-        process.kill()
-        logging.error("AppleScript timed out while waiting for user response.")
-        return 'Deny'
-
-def trigger_delay_notification_with_response(title, message, timeout=60):
+    logging.info("User accepted the invitation to chat.")
+    set_conversation_active(True)
+    logging.info("New conversation started and set to active.")
+    webbrowser.open('http://localhost:5050')
+    logging.info("Chat interface opened successfully.")
+
+def suppress_notifications(delay_minutes):
     """
-    Sends a macOS notification to choose delay duration with predefined options or custom input.
-    Returns the delay duration in minutes as an integer.
+    Dispatcher callback: the user denied and chose how long to delay future alerts.
     """
-    delay_minutes = None
-
-    script = f'''
-    set delayChoice to button returned of (display dialog "{message}" with title "{title}" buttons {{"5 mins", "15 mins", "Custom"}} default button "5 mins")
-    return delayChoice
-    '''
-    try:
-        logging.info("Sending desktop notification for delay duration selection.")
-        process = subprocess.Popen(['osascript', '-e', script],
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE)
-        stdout, stderr = process.communicate(timeout=timeout)
-        if process.returncode != 0:
-            logging.error(f"AppleScript Error: {stderr.decode('utf-8').strip()}")
-            return 5
-        delay_choice = stdout.decode('utf-8').strip()
-        logging.info(f"User selected delay choice: {delay_choice}")
-
-        if delay_choice == "Custom":
-            custom_script = f'''
-            set userInput to text returned of (display dialog "Enter delay duration in minutes:" with title "{title}" default answer "10")
-            return userInput
-            '''
-            try:
-                logging.info("Sending desktop notification for custom delay input.")
-                custom_process = subprocess.Popen(['osascript', '-e', custom_script],
-                                                    stdout=subprocess.PIPE,
-                                                    stderr=subprocess.PIPE)
-                custom_stdout, custom_stderr = custom_process.communicate(timeout=timeout)
-                if custom_process.returncode != 0:
-                    logging.error(f"AppleScript Error: {custom_stderr.decode('utf-8').strip()}")
-                    return 5
-                custom_input = custom_stdout.decode('utf-8').strip()
-                try:
-                    delay_minutes = int(custom_input)
-                    logging.info(f"Custom delay input: {delay_minutes} minutes")
-                except ValueError:
-                    delay_minutes = 5
-                    logging.warning(f"Invalid custom delay input: '{custom_input}'. Defaulting to 5 minutes.")
-            except subprocess.TimeoutExpired:
-                custom_process.kill()
-                logging.error("AppleScript timed out while waiting for custom delay input.")
-                return 5
-        else:
-            try:
-                delay_minutes = int(delay_choice.split()[0])
-                logging.info(f"Parsed delay minutes: {delay_minutes} minutes")
-            except ValueError:
-                delay_minutes = 5
-                logging.warning(f"Invalid delay choice: '{delay_choice}'. Defaulting to 5 minutes.")
-    except subprocess.TimeoutExpired:
-        process.kill()
-        logging.error("AppleScript timed out while waiting for delay duration selection.")
-        return 5
-
-    logging.info(f"Delay set to {delay_minutes} minute(s).")
-    return delay_minutes
+    global notifications_suppressed, notifications_suppressed_until
+    chat_prewarm.discard()
+    with notifications_suppression_lock:
+        notifications_suppressed = True
+        notifications_suppressed_until = datetime.now(timezone.utc) + timedelta(minutes=delay_minutes)
+        logging.info(
+            f"Notifications suppressed until {notifications_suppressed_until.isoformat()} UTC "
+            f"(for {delay_minutes} minute(s))."
+        )
 
 def intervention_handler():
     """
@@ -142,21 +81,19 @@ def intervention_handler():
 
     logging.info("Entering intervention_handler.")
 
-    with running_context_lock:
-        if not running_context:
-            logging.warning("No aggregated data available.")
-            return
-        aggregated_data_entry = running_context[-1]
-        running_context_entries = running_context[:-1] if len(running_context) > 1 else []
-        logging.debug(f"Aggregated Data Entry: {aggregated_data_entry}")
-        logging.debug(f"Running Context Entries: {running_context_entries}")
+    aggregated_data_entry, context_logs = running_context.snapshot()
+    if aggregated_data_entry is None:
+        logging.warning("No aggregated data available.")
+        return
+    logging.debug(f"Aggregated Data Entry: {aggregated_data_entry}")
+    logging.debug(f"Condensed Context: {dict(context_logs)}")
 
     # Check global permission, optionally run Detection LLM.
     if is_conversation_active():
         logging.info("Detected a conversation is active - Skipping Detection LLM invocation.")
         return
     else:
-        decision = detection_llm(aggregated_data_entry, running_context_entries)
+        decision = detection_llm(aggregated_data_entry, context_logs)
         logging.info(f"Detection LLM decision: {decision}")
 
     if decision == 'TRUE':
@@ -179,55 +116,24 @@ def intervention_handler():
                     notifications_suppressed_until = datetime.min.replace(tzinfo=timezone.utc)
                     logging.info("Notifications were suppressed, but suppression window ended. Re-enabling notifications.")
 
-        title = "Productivity Alert"
-        message = "We detected a dip in your productivity. Would you like to chat about it?"
-        user_response = trigger_desktop_notification_with_response(title, message)
-
-        if user_response == 'Accept':
-            logging.info("User accepted the invitation to chat.")
-            set_conversation_active(True)
-            logging.info("New conversation started and set to active.")
-            webbrowser.open('http://localhost:5050')
-            logging.info("Chat interface opened successfully.")
-
-        else:
-            logging.info("User selected 'Deny'. Prompting for delay duration.")
-            delay_title = "Notification Delay"
-            delay_message = "Choose how long you want to delay future productivity alerts:"
-            delay_minutes = trigger_delay_notification_with_response(delay_title, delay_message)
-
-            if delay_minutes:
-                with notifications_suppression_lock:
-                    notifications_suppressed = True
-                    notifications_suppressed_until = datetime.now(timezone.utc) + timedelta(minutes=delay_minutes)
-                    logging.info(
-                        f"Notifications suppressed until {notifications_suppressed_until.isoformat()} UTC "
-                        f"(for {delay_minutes} minute(s))."
-                    )
-            else:
-                with notifications_suppression_lock:
-                    notifications_suppressed = True
-                    notifications_suppressed_until = datetime.now(timezone.utc) + timedelta(minutes=5)
-                    logging.warning(
-                        f"Failed to parse delay. Defaulting to 5 minutes. "
-                        f"Notifications suppressed until {notifications_suppressed_until.isoformat()} UTC."
-                    )
+        # Prompting happens on the dispatcher thread; the user's answer arrives through the callbacks.
+        # Meanwhile the chat model is warmed up speculatively so the chat is ready on Accept.
+        if notification_dispatcher.request_intervention(accept_intervention, suppress_notifications):
+            chat_prewarm.start()
     else:
         logging.info("Detection LLM decision is not 'TRUE'. No action taken.")
 
 def intervention_monitor():
     """
-    Background thread, runs intervention_handler(). 
+    Background thread, runs intervention_handler() whenever the detection scheduler
+    sees enough new distracting activity from the log watcher.
     """
     logging.info("Intervention Monitor thread started.")
-
-    while True:
-        logging.info("Checking for possible intervention.")
-        intervention_handler()
-        time.sleep(300)
+    detection_scheduler.run(intervention_handler)
 
 if __name__ == "__main__":
     # Log Watcher
+    add_aggregate_listener(detection_scheduler.publish)
     watcher_thread = threading.Thread(target=log_watcher, name="LogWatcherThread")
     watcher_thread.start()
     logging.info("Log Watcher started.")
@@ -237,6 +143,13 @@ if __name__ == "__main__":
     intervention_thread.start()
     logging.info("Intervention Monitor started.")
 
+    # Notification prompts
+    notification_dispatcher.start()
+    logging.info(f"Notification dispatcher started with the {notification_dispatcher.backend.name} backend.")
+
+    # Background chat summaries, resuming any left unfinished by the last run
+    summary_jobs.start()
+
     # Conversational Agent
     logging.info("Starting Flask app for the Conversational Agent.")
     socketio.run(app, host='0.0.0.0', port=5050, debug=False)
\ No newline at end of file
@@ -0,0 +1,34 @@
+import threading
+from collections import defaultdict
+
+class LatencyStats:
+    """
+    Per-key latency counters in milliseconds (count, total, max, last and failures),
+    shared between threads. snapshot() adds the mean.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = defaultdict(lambda: {'count': 0, 'failures': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'last_ms': 0.0})
+
+    def record(self, key, latency_ms):
+        with self.lock:
+            stats = self.stats[key]
+            stats['count'] += 1
+            stats['total_ms'] += latency_ms
+            stats['last_ms'] = latency_ms
+            stats['max_ms'] = max(stats['max_ms'], latency_ms)
+
+    def record_failure(self, key):
+        with self.lock:
+            self.stats[key]['failures'] += 1
+
+    def snapshot(self):
+        """
+        Returns a copy of every key's counters, including mean_ms.
+        """
+        with self.lock:
+            snapshot = {key: dict(stats) for key, stats in self.stats.items()}
+        for stats in snapshot.values():
+            stats['mean_ms'] = stats['total_ms'] / stats['count'] if stats['count'] else 0.0
+        return snapshot
@@ -0,0 +1,254 @@
+import logging
+import os
+import platform
+import queue
+import shutil
+import subprocess
+import threading
+import uuid
+from abc import ABC, abstractmethod
+
+# 'osascript', 'notify-send', 'socketio' or 'fake'; picked from the platform when unset.
+NOTIFICATION_BACKEND = os.environ.get('NOTIFICATION_BACKEND')
+PROMPT_TIMEOUT = 30
+DELAY_TIMEOUT = 60
+DELAY_CHOICES = ["5 mins", "15 mins", "Custom"]
+DEFAULT_DELAY_MINUTES = 5
+
+INTERVENTION_TITLE = "Productivity Alert"
+INTERVENTION_MESSAGE = "We detected a dip in your productivity. Would you like to chat about it?"
+DELAY_TITLE = "Notification Delay"
+DELAY_MESSAGE = "Choose how long you want to delay future productivity alerts:"
+
+class NotificationBackend(ABC):
+    """
+    Shows blocking prompts to the user. Only ever called from the dispatcher's worker thread.
+    ask returns the chosen button and ask_text the entered text; both return None on timeout or error.
+    Backends must implement ask; ask_text is optional.
+    """
+    name = 'base'
+
+    @abstractmethod
+    def ask(self, title, message, buttons, default, timeout):
+        pass
+
+    def ask_text(self, title, message, default_answer, timeout):
+        return None
+
+class OsascriptBackend(NotificationBackend):
+    """
+    macOS dialogs through AppleScript.
+    """
+    name = 'osascript'
+
+    def run_script(self, script, timeout):
+        try:
+            process = subprocess.run(['osascript', '-e', script], capture_output=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            logging.error("AppleScript timed out while waiting for user response.")
+            return None
+        if process.returncode != 0:
+            logging.error(f"AppleScript Error: {process.stderr.decode('utf-8').strip()}")
+            return None
+        return process.stdout.decode('utf-8').strip()
+
+    def ask(self, title, message, buttons, default, timeout):
+        button_list = ', '.join(f'"{button}"' for button in buttons)
+        script = f'''
+        set userChoice to button returned of (display dialog "{message}" with title "{title}" buttons {{{button_list}}} default button "{default}")
+        return userChoice
+        '''
+        return self.run_script(script, timeout)
+
+    def ask_text(self, title, message, default_answer, timeout):
+        script = f'''
+        set userInput to text returned of (display dialog "{message}" with title "{title}" default answer "{default_answer}")
+        return userInput
+        '''
+        return self.run_script(script, timeout)
+
+class NotifySendBackend(NotificationBackend):
+    """
+    Linux desktop notifications with action buttons (libnotify's notify-send 0.7.9+, over D-Bus).
+    Free-text input is not supported, so ask_text always returns None.
+    """
+    name = 'notify-send'
+
+    def ask(self, title, message, buttons, default, timeout):
+        command = ['notify-send', '--wait', f'--expire-time={timeout * 1000}', '--app-name=LLMActivityWatch']
+        command += [f'--action={button}={button}' for button in buttons]
+        command += [title, message]
+        try:
+            process = subprocess.run(command, capture_output=True, timeout=timeout + 5)
+        except subprocess.TimeoutExpired:
+            logging.error("notify-send timed out while waiting for user response.")
+            return None
+        if process.returncode != 0:
+            logging.error(f"notify-send Error: {process.stderr.decode('utf-8').strip()}")
+            return None
+        choice = process.stdout.decode('utf-8').strip()
+        return choice if choice in buttons else None
+
+class SocketIOBackend(NotificationBackend):
+    """
+    In-browser prompts: emits 'intervention_prompt' to connected chat pages and waits for
+    the matching 'intervention_response' event.
+    """
+    name = 'socketio'
+
+    def __init__(self, socketio):
+        self.socketio = socketio
+        self.pending = {}  # prompt id -> (threading.Event, [answer])
+        self.lock = threading.Lock()
+        socketio.on_event('intervention_response', self.handle_response)
+
+    def handle_response(self, data):
+        data = data or {}
+        with self.lock:
+            waiter = self.pending.get(data.get('id'))
+        if waiter is None:
+            logging.warning(f"Ignoring response to unknown or expired prompt: {data}")
+            return
+        waiter[1].append(data.get('answer'))
+        waiter[0].set()
+
+    def prompt(self, payload, timeout):
+        prompt_id = uuid.uuid4().hex
+        waiter = (threading.Event(), [])
+        with self.lock:
+            self.pending[prompt_id] = waiter
+        try:
+            self.socketio.emit('intervention_prompt', dict(payload, id=prompt_id))
+            if not waiter[0].wait(timeout):
+                logging.error("Timed out waiting for an in-browser response.")
+                return None
+            return waiter[1][0]
+        finally:
+            with self.lock:
+                self.pending.pop(prompt_id, None)
+            self.socketio.emit('intervention_prompt_closed', {'id': prompt_id})
+
+    def ask(self, title, message, buttons, default, timeout):
+        answer = self.prompt({'title': title, 'message': message, 'buttons': buttons, 'default': default}, timeout)
+        return answer if answer in buttons else None
+
+    def ask_text(self, title, message, default_answer, timeout):
+        return self.prompt({'title': title, 'message': message, 'buttons': ['OK'], 'input': default_answer}, timeout)
+
+class FakeBackend(NotificationBackend):
+    """
+    Scripted answers for testing the intervention flow anywhere. Records every prompt it is shown.
+    """
+    name = 'fake'
+
+    def __init__(self, answers=()):
+        self.answers = list(answers)
+        self.prompts = []
+
+    def next_answer(self, title, message):
+        self.prompts.append((title, message))
+        return self.answers.pop(0) if self.answers else None
+
+    def ask(self, title, message, buttons, default, timeout):
+        return self.next_answer(title, message)
+
+    def ask_text(self, title, message, default_answer, timeout):
+        return self.next_answer(title, message)
+
+def default_backend(socketio=None):
+    """
+    Backend named by NOTIFICATION_BACKEND, else osascript on macOS, notify-send when available,
+    and the in-browser prompt otherwise.
+    """
+    name = NOTIFICATION_BACKEND
+    if name is None:
+        if platform.system() == 'Darwin':
+            name = 'osascript'
+        elif shutil.which('notify-send'):
+            name = 'notify-send'
+        else:
+            name = 'socketio'
+            logging.warning(
+                "notify-send not found; intervention prompts will only reach an open chat page and "
+                f"otherwise go unanswered for {PROMPT_TIMEOUT}s. Install libnotify or set NOTIFICATION_BACKEND."
+            )
+    if name == 'osascript':
+        return OsascriptBackend()
+    if name == 'notify-send':
+        return NotifySendBackend()
+    if name == 'fake':
+        return FakeBackend()
+    if name == 'socketio' and socketio is not None:
+        return SocketIOBackend(socketio)
+    raise ValueError(f"Unknown or unavailable notification backend: {name}")
+
+def parse_delay_minutes(choice):
+    """
+    '15 mins' or '15' -> 15; anything unparsable -> DEFAULT_DELAY_MINUTES.
+    """
+    try:
+        minutes = int(str(choice).split()[0])
+    except (ValueError, IndexError):
+        logging.warning(f"Invalid delay choice: '{choice}'. Defaulting to {DEFAULT_DELAY_MINUTES} minutes.")
+        return DEFAULT_DELAY_MINUTES
+    return minutes if minutes > 0 else DEFAULT_DELAY_MINUTES
+
+class NotificationDispatcher:
+    """
+    Runs intervention prompts on a worker thread so the caller never waits on the user.
+    At most one prompt sequence is queued or showing; further requests are dropped until it finishes.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.requests = queue.Queue()
+        self.busy = threading.Event()
+        self.worker = None
+        self.worker_lock = threading.Lock()
+
+    def start(self):
+        with self.worker_lock:
+            if self.worker is None:
+                self.worker = threading.Thread(target=self.run, name="NotificationThread", daemon=True)
+                self.worker.start()
+
+    def request_intervention(self, on_accept, on_delay):
+        """
+        Queue the accept/deny prompt. on_accept() runs if the user accepts; otherwise the user is
+        asked for a delay and on_delay(minutes) runs. Returns False if a prompt is already pending.
+        """
+        if self.busy.is_set():
+            logging.info("A notification prompt is already pending - not stacking another one.")
+            return False
+        self.busy.set()
+        self.start()
+        self.requests.put((on_accept, on_delay))
+        return True
+
+    def run(self):
+        while True:
+            on_accept, on_delay = self.requests.get()
+            try:
+                self.prompt_intervention(on_accept, on_delay)
+            except Exception as e:
+                logging.error(f"Notification prompt failed: {e}", exc_info=True)
+            finally:
+                self.busy.clear()
+
+    def prompt_intervention(self, on_accept, on_delay):
+        logging.info(f"Sending intervention prompt through the {self.backend.name} backend.")
+        choice = self.backend.ask(INTERVENTION_TITLE, INTERVENTION_MESSAGE, ["Deny", "Accept"], "Accept", PROMPT_TIMEOUT)
+        logging.info(f"User selected: {choice}")
+        if choice == 'Accept':
+            on_accept()
+            return
+        on_delay(self.ask_delay_minutes())
+
+    def ask_delay_minutes(self):
+        choice = self.backend.ask(DELAY_TITLE, DELAY_MESSAGE, DELAY_CHOICES, DELAY_CHOICES[0], DELAY_TIMEOUT)
+        logging.info(f"User selected delay choice: {choice}")
+        if choice is None:
+            return DEFAULT_DELAY_MINUTES
+        if choice == "Custom":
+            choice = self.backend.ask_text(DELAY_TITLE, "Enter delay duration in minutes:", "10", DELAY_TIMEOUT)
+        return parse_delay_minutes(choice)
@@ -0,0 +1,92 @@
+import threading
+from collections import defaultdict
+
+# Rough characters per token for Llama 3 on English text and dict reprs; errs on the high side.
+CHARS_PER_TOKEN = 3.5
+OTHER_TITLE = "other"
+
+prompt_stats = defaultdict(lambda: {'builds': 0, 'total_tokens': 0, 'max_tokens': 0, 'last_tokens': 0, 'items_dropped': 0})
+prompt_stats_lock = threading.Lock()
+
+def estimate_tokens(text):
+    """
+    Cheap token estimate from character count, used to keep prompts within budget.
+    """
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+def compact_durations(durations, max_titles, keep=None):
+    """
+    Keep the max_titles longest activities (plus any title for which keep(title) is true),
+    roll the rest into a single 'other' entry and round every duration to whole seconds.
+    Returns (compacted dict, number of titles rolled up).
+    """
+    ranked = sorted(durations.items(), key=lambda item: item[1], reverse=True)
+    compacted = {}
+    other = 0.0
+    rolled_up = 0
+    for title, duration in ranked:
+        if len(compacted) < max_titles or (keep is not None and keep(title)):
+            compacted[title] = round(duration)
+        else:
+            other += duration
+            rolled_up += 1
+    if rolled_up:
+        compacted[OTHER_TITLE] = compacted.get(OTHER_TITLE, 0) + round(other)
+    return compacted, rolled_up
+
+def fit_durations(durations, token_budget, max_titles, keep=None):
+    """
+    Compact durations, shrinking the number of titles until its rendered form fits token_budget.
+    Titles matched by keep are never rolled up. Returns (compacted dict, titles rolled up).
+    """
+    compacted, rolled_up = compact_durations(durations, max_titles, keep)
+    while max_titles > 1 and estimate_tokens(str(compacted)) > token_budget:
+        max_titles = max(1, max_titles // 2)
+        compacted, rolled_up = compact_durations(durations, max_titles, keep)
+    return compacted, rolled_up
+
+def fit_entries(entries, token_budget):
+    """
+    Keep entries in their given order (most important first) until token_budget is spent.
+    Returns (kept entries, number dropped).
+    """
+    kept = []
+    used = 0
+    for entry in entries:
+        cost = estimate_tokens(entry)
+        if used + cost > token_budget:
+            continue
+        kept.append(entry)
+        used += cost
+    return kept, len(entries) - len(kept)
+
+def truncate_to_budget(text, token_budget):
+    """
+    Cut text to roughly token_budget tokens, keeping the beginning.
+    """
+    max_chars = int(token_budget * CHARS_PER_TOKEN)
+    return text if len(text) <= max_chars else text[:max_chars].rstrip() + " ..."
+
+def record_prompt(kind, prompt, items_dropped=0):
+    """
+    Record the estimated size of a built prompt under kind (e.g. 'detection', 'chat').
+    """
+    tokens = estimate_tokens(prompt)
+    with prompt_stats_lock:
+        stats = prompt_stats[kind]
+        stats['builds'] += 1
+        stats['total_tokens'] += tokens
+        stats['last_tokens'] = tokens
+        stats['max_tokens'] = max(stats['max_tokens'], tokens)
+        stats['items_dropped'] += items_dropped
+    return tokens
+
+def get_prompt_stats():
+    """
+    Returns per-kind prompt size counters, including the mean estimated token count.
+    """
+    with prompt_stats_lock:
+        snapshot = {kind: dict(stats) for kind, stats in prompt_stats.items()}
+    for stats in snapshot.values():
+        stats['mean_tokens'] = stats['total_tokens'] / stats['builds'] if stats['builds'] else 0.0
+    return snapshot
@@ -0,0 +1,148 @@
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+from knowledge_store import DB_PATH
+
+# Job lifecycle: pending -> running -> saved | empty | needs_review | failed.
+# needs_review jobs (knowledge base full) end as saved or discarded from the memory management page.
+FINISHED_STATUSES = ('saved', 'empty', 'failed', 'discarded')
+# needs_review jobs nobody reviewed are discarded after this long.
+REVIEW_EXPIRY_SECONDS = 60 * 60 * 24 * 7
+# Finished jobs, transcript included, are deleted this long after their last update.
+JOB_RETENTION_SECONDS = 60 * 60 * 24 * 30
+
+class SummaryJobQueue:
+    """
+    Background end-of-chat summarization jobs, persisted in SQLite so a restart resumes them.
+    process(transcript) returns (status, summary); on_update(job) is called after every status change.
+    """
+
+    def __init__(self, process, on_update=None, db_path=DB_PATH):
+        self.process = process
+        self.on_update = on_update
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.worker = None
+        self.worker_lock = threading.Lock()
+
+        with self.lock:
+            self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS summary_jobs (
+                id TEXT PRIMARY KEY,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                status TEXT NOT NULL,
+                transcript TEXT NOT NULL,
+                summary TEXT,
+                error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_summary_jobs_status ON summary_jobs(status);
+            ''')
+            self.conn.commit()
+
+    def start(self):
+        """
+        Start the worker, first re-queueing jobs left pending or running by a previous process.
+        """
+        with self.worker_lock:
+            if self.worker is not None:
+                return
+            with self.lock, self.conn:
+                self.conn.execute("UPDATE summary_jobs SET status = 'pending' WHERE status = 'running'")
+                pending = [row[0] for row in self.conn.execute(
+                    "SELECT id FROM summary_jobs WHERE status = 'pending' ORDER BY created_at"
+                )]
+            self.prune()
+            for job_id in pending:
+                self.queue.put(job_id)
+            if pending:
+                logging.info(f"Resuming {len(pending)} unfinished summary job(s).")
+            self.worker = threading.Thread(target=self.run, name="SummaryJobThread", daemon=True)
+            self.worker.start()
+
+    def submit(self, transcript):
+        """
+        Persist a summarization job for transcript ([(speaker, text), ...]) and return its id.
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO summary_jobs (id, created_at, updated_at, status, transcript) VALUES (?, ?, ?, 'pending', ?)",
+                (job_id, now, now, json.dumps(transcript))
+            )
+        self.start()
+        self.queue.put(job_id)
+        return job_id
+
+    def get(self, job_id):
+        """
+        Returns the job as a dict (without its transcript), or None if unknown.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT id, created_at, updated_at, status, summary, error FROM summary_jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('id', 'created_at', 'updated_at', 'status', 'summary', 'error'), row))
+
+    def update(self, job_id, status, summary=None, error=None):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE summary_jobs SET status = ?, updated_at = ?, summary = COALESCE(?, summary), error = ? WHERE id = ?",
+                (status, time.time(), summary, error, job_id)
+            )
+        job = self.get(job_id)
+        if self.on_update is not None and job is not None:
+            try:
+                self.on_update(job)
+            except Exception as e:
+                logging.error(f"Summary job update callback failed: {e}", exc_info=True)
+        return job
+
+    def prune(self):
+        """
+        Discard needs_review jobs older than REVIEW_EXPIRY_SECONDS and delete finished jobs
+        older than JOB_RETENTION_SECONDS, so the table does not grow with every chat.
+        """
+        now = time.time()
+        with self.lock, self.conn:
+            expired = self.conn.execute(
+                "UPDATE summary_jobs SET status = 'discarded', updated_at = ? WHERE status = 'needs_review' AND updated_at < ?",
+                (now, now - REVIEW_EXPIRY_SECONDS)
+            ).rowcount
+            deleted = self.conn.execute(
+                f"DELETE FROM summary_jobs WHERE status IN ({', '.join('?' * len(FINISHED_STATUSES))}) AND updated_at < ?",
+                (*FINISHED_STATUSES, now - JOB_RETENTION_SECONDS)
+            ).rowcount
+        if expired or deleted:
+            logging.info(f"Pruned summary jobs: {expired} unreviewed discarded, {deleted} old finished deleted.")
+
+    def run(self):
+        while True:
+            job_id = self.queue.get()
+            with self.lock:
+                row = self.conn.execute(
+                    "SELECT transcript FROM summary_jobs WHERE id = ? AND status = 'pending'", (job_id,)
+                ).fetchone()
+            if row is None:
+                continue
+            self.update(job_id, 'running')
+            try:
+                status, summary = self.process(json.loads(row[0]))
+                self.update(job_id, status, summary)
+            except Exception as e:
+                logging.error(f"Summary job {job_id} failed: {e}", exc_info=True)
+                self.update(job_id, 'failed', error=str(e))
+            self.prune()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+# The modules live at the repository root and open their SQLite stores (activity_logs.db,
+# knowledge_base.db) in the working directory on import; run the tests from a scratch directory.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix='llmactivitywatch-tests-'))
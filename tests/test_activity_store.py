@@ -0,0 +1,29 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import activity_store
+from activity_store import ActivityStore
+
+class DecisionRetentionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = ActivityStore(os.path.join(tempfile.mkdtemp(), 'activity.db'))
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_rollup_keeps_newest_decisions_per_source(self):
+        for index in range(5):
+            self.store.record_decision({'YouTube': index}, {}, 'TRUE', 'llm')
+        self.store.record_decision({'Reddit': 1}, {}, 'FALSE', 'classifier')
+
+        with mock.patch.object(activity_store, 'DECISION_RETENTION_ROWS', 3):
+            self.store.rollup()
+
+        self.assertEqual([recent['YouTube'] for recent, _, _ in self.store.labeled_decisions('llm', 10)], [4, 3, 2])
+        self.assertEqual(len(self.store.labeled_decisions('classifier', 10)), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import re
+import unittest
+from unittest import mock
+
+import detection_llm
+from detection_llm import distracting_site_durations, passes_prefilter
+
+class DistractingSiteDurationsTest(unittest.TestCase):
+
+    def test_normalized_categories(self):
+        self.assertEqual(distracting_site_durations({'YouTube': 100, 'Reddit': 30, 'GitHub': 500}), {'YouTube': 100.0, 'Reddit': 30.0})
+
+    def test_raw_title_on_site(self):
+        self.assertEqual(distracting_site_durations({'Funny cats - YouTube — Mozilla Firefox': 90}), {'YouTube': 90.0})
+
+    def test_title_mentioning_site_is_not_the_site(self):
+        durations = {
+            'youtube-dl/README.md - VS Code': 100,
+            'Fix reddit embed · Pull Request #12 · org/repo — GitHub': 100,
+            'linkedin-api/README.md at main · GitHub': 100,
+        }
+        self.assertEqual(distracting_site_durations(durations), {})
+        self.assertFalse(passes_prefilter(durations, {}))
+
+class DetectionGrammarTest(unittest.TestCase):
+
+    def test_token_cap_covers_longest_grammar_output(self):
+        char_class, max_chars = re.search(r'reason ::= (\[.*?\])\{1,(\d+)\}', detection_llm.DETECTION_GRAMMAR).groups()
+        allowed = [chr(code) for code in range(0x110000) if re.fullmatch(char_class, chr(code))]
+        # At most one token per character only holds for ASCII; quotes and backslashes would break the JSON.
+        self.assertTrue(all(ord(char) < 128 for char in allowed))
+        self.assertNotIn('"', allowed)
+        self.assertNotIn('\\', allowed)
+
+        longest = '{"reason": "%s", "decision": false}' % ('~' * int(max_chars))
+        self.assertLessEqual(len(longest), detection_llm.MAX_NEW_TOKENS['structured'])
+        with mock.patch.object(detection_llm, 'DETECTION_OUTPUT_MODE', 'structured'):
+            self.assertEqual(detection_llm.parse_decision(longest), 'FALSE')
+
+if __name__ == '__main__':
+    unittest.main()
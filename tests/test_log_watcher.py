@@ -0,0 +1,44 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import log_watcher
+
+WINDOW_START = datetime(2026, 1, 5, 10, 5, tzinfo=timezone.utc)
+WINDOW_END = WINDOW_START + timedelta(minutes=5)
+
+def event(title, start, seconds):
+    return {'timestamp': start.isoformat(), 'duration': seconds, 'data': {'title': title}}
+
+# Starts before the window and ends after it, plus one event fully inside it.
+WINDOW_EVENTS = [
+    event('Funny cats - YouTube', WINDOW_START - timedelta(minutes=3), 600),
+    event('notes.txt - Vim', WINDOW_START + timedelta(minutes=1), 60),
+]
+AFK_EVENTS = [
+    {'timestamp': (WINDOW_START - timedelta(hours=1)).isoformat(), 'duration': 7200, 'data': {'status': 'not-afk'}},
+]
+
+def fake_activitywatch(method, url, label, **kwargs):
+    """
+    Buckets return every overlapping event unclipped; the query returns the window events
+    intersected with not-afk time, which here covers the whole window.
+    """
+    if method == 'POST':
+        return [WINDOW_EVENTS]
+    return WINDOW_EVENTS if label == log_watcher.WINDOW_BUCKET else AFK_EVENTS
+
+class FetchModesTest(unittest.TestCase):
+
+    def fetch(self, mode):
+        with mock.patch.object(log_watcher, 'FETCH_MODE', mode), \
+                mock.patch.object(log_watcher, 'request_json', side_effect=fake_activitywatch):
+            return log_watcher.fetch_aggregated(WINDOW_START, WINDOW_END)
+
+    def test_straddling_event_clipped_to_window_in_both_modes(self):
+        raw = self.fetch('raw')
+        self.assertEqual(raw, {'YouTube': 300.0, 'notes.txt - Vim': 60.0})
+        self.assertEqual(self.fetch('query'), raw)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import threading
+import unittest
+from unittest import mock
+
+import notifications
+from notifications import DEFAULT_DELAY_MINUTES, FakeBackend, NotificationDispatcher
+
+class NotificationDispatcherTest(unittest.TestCase):
+
+    def run_prompt(self, answers):
+        """
+        Drive one intervention through a FakeBackend; returns (accepted, delay minutes, backend).
+        """
+        backend = FakeBackend(answers)
+        dispatcher = NotificationDispatcher(backend)
+        done = threading.Event()
+        result = {'accepted': False, 'delay': None}
+
+        def on_accept():
+            result['accepted'] = True
+            done.set()
+
+        def on_delay(minutes):
+            result['delay'] = minutes
+            done.set()
+
+        self.assertTrue(dispatcher.request_intervention(on_accept, on_delay))
+        self.assertTrue(done.wait(5))
+        return result['accepted'], result['delay'], backend
+
+    def test_accept(self):
+        accepted, delay, backend = self.run_prompt(['Accept'])
+        self.assertTrue(accepted)
+        self.assertIsNone(delay)
+        self.assertEqual(len(backend.prompts), 1)
+
+    def test_decline_asks_for_delay(self):
+        accepted, delay, _ = self.run_prompt(['Deny', '15 mins'])
+        self.assertFalse(accepted)
+        self.assertEqual(delay, 15)
+
+    def test_decline_with_custom_delay(self):
+        _, delay, backend = self.run_prompt(['Deny', 'Custom', '42'])
+        self.assertEqual(delay, 42)
+        self.assertEqual(len(backend.prompts), 3)
+
+    def test_timeout_delays_by_default(self):
+        # FakeBackend answers None, like a real backend whose prompt timed out.
+        accepted, delay, _ = self.run_prompt([])
+        self.assertFalse(accepted)
+        self.assertEqual(delay, DEFAULT_DELAY_MINUTES)
+
+    def test_pending_prompt_is_not_stacked(self):
+        release = threading.Event()
+        backend = FakeBackend()
+        backend.ask = lambda *args: release.wait(5) and 'Accept'
+        dispatcher = NotificationDispatcher(backend)
+        accepted = threading.Event()
+
+        self.assertTrue(dispatcher.request_intervention(accepted.set, lambda minutes: None))
+        self.assertFalse(dispatcher.request_intervention(accepted.set, lambda minutes: None))
+        release.set()
+        self.assertTrue(accepted.wait(5))
+
+class DefaultBackendTest(unittest.TestCase):
+
+    def test_socketio_fallback_warns(self):
+        with mock.patch.object(notifications, 'NOTIFICATION_BACKEND', None), \
+                mock.patch.object(notifications.platform, 'system', return_value='Linux'), \
+                mock.patch.object(notifications.shutil, 'which', return_value=None), \
+                self.assertLogs(level='WARNING'):
+            backend = notifications.default_backend(socketio=mock.Mock())
+        self.assertEqual(backend.name, 'socketio')
+
+if __name__ == '__main__':
+    unittest.main()
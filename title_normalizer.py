@@ -0,0 +1,89 @@
+import re
+from functools import lru_cache
+
+# Canonical app/site category -> regex fragments for the site/app name, matched case-insensitively
+# at the start of a title segment (see match_category).
+# The first four names match detection_llm.DISTRACTING_SITES so categories can be checked directly.
+CATEGORY_PATTERNS = {
+    'YouTube': [r'youtube', r'youtu\.be'],
+    'Instagram': [r'instagram'],
+    'Reddit': [r'reddit'],
+    'Linkedin': [r'linkedin'],
+    'Twitter': [r'twitter', r'\bx\.com\b'],
+    'Facebook': [r'facebook'],
+    'Netflix': [r'netflix'],
+    'Twitch': [r'twitch'],
+    'Gmail': [r'gmail'],
+    'Slack': [r'\bslack\b'],
+    'Google Docs': [r'google docs'],
+    'Google Sheets': [r'google sheets'],
+    'GitHub': [r'github'],
+    'Stack Overflow': [r'stack overflow', r'stackoverflow'],
+    'ChatGPT': [r'chatgpt'],
+}
+
+# Noise stripped from titles that do not map to a category.
+NOTIFICATION_COUNT = re.compile(r'^\(\d+\+?\)\s*')
+BROWSER_SUFFIX = re.compile(
+    r'\s+[-—–]\s+(Mozilla Firefox|Google Chrome|Chromium|Brave|Microsoft Edge|Safari|Arc|Opera)$'
+)
+
+# Separators between the page part and the site/app part of a title, e.g. "Page · Repo — GitHub".
+SEGMENT_SEPARATOR = re.compile(r'\s+[-—–·|•]\s+')
+# A site name only counts as the whole segment head, optionally as a domain; "youtube-dl",
+# "linkedin-api/README.md" or "reddit.py" are things named after a site, not the site.
+SITE_NAME = r'^(?:www\.)?(?:{alternation})(?:\.com)?(?![\w./-])'
+
+TITLE_CACHE_SIZE = 4096
+
+def compile_alternation(categories, template):
+    """
+    Compile {category: [patterns]} into a single case-insensitive alternation with one named group
+    per category, placed in template. Returns (compiled pattern, {group name: category}).
+    """
+    group_names = {}
+    alternatives = []
+    for index, (category, patterns) in enumerate(categories.items()):
+        group = f"c{index}"
+        group_names[group] = category
+        alternatives.append(f"(?P<{group}>{'|'.join(patterns)})")
+    pattern = re.compile(template.format(alternation='|'.join(alternatives)), re.IGNORECASE)
+    return pattern, group_names
+
+def compile_site_matcher(categories):
+    """
+    Returns a function mapping a cleaned title to the category of its site/app segment, or None.
+    Segments are tried from the right, where browsers and apps put the site name, so
+    "How to download youtube-dl - Stack Overflow" is Stack Overflow, not YouTube.
+    """
+    pattern, group_names = compile_alternation(categories, SITE_NAME)
+
+    def match(title):
+        for segment in reversed(SEGMENT_SEPARATOR.split(title)):
+            found = pattern.match(segment.strip())
+            if found:
+                return group_names[found.lastgroup]
+        return None
+
+    return match
+
+match_category = compile_site_matcher(CATEGORY_PATTERNS)
+
+def clean_title(title):
+    """
+    Strip notification counters and browser suffixes, leaving the page and site segments.
+    """
+    return BROWSER_SUFFIX.sub('', NOTIFICATION_COUNT.sub('', title.strip()))
+
+@lru_cache(maxsize=TITLE_CACHE_SIZE)
+def normalize_title(title):
+    """
+    Map a raw window title to its canonical category, e.g.
+    "(3) Reddit - Dive into anything — Mozilla Firefox" -> "Reddit".
+    Titles outside every category are returned without notification counters or browser suffixes.
+    """
+    cleaned = clean_title(title)
+    category = match_category(cleaned)
+    if category is not None:
+        return category
+    return cleaned or title